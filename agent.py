@@ -1,9 +1,22 @@
+from typing import NamedTuple
+
 import numpy as np
 
 
+class Agent_Type(NamedTuple):
+    """
+    The parameters of a kind of agent, e.g. a fast learner, used to build mixed pairings
+    """
+    name: str
+    learning_rate: float = 0.5
+    aspiration: float = 2
+    habituation: float = 0
+    probab_init: float = 0.5
+
+
 class Agent:
     def __init__(self, learning_rate=0.5, aspiration=2, habituation=0, probab_init=0.5):
-        self.proba = np.full(shape=2, fill_value=probab_init, dtype=np.float64)
+        self.proba = np.array([probab_init, 1 - probab_init], dtype=np.float64)
         self.leara = learning_rate
         self.aspi = aspiration
         self.habi = habituation
@@ -33,13 +46,17 @@ class Agent:
         self.aspi = (1 - self.habi) * self.aspi + self.habi * payoff
         return self.aspi
 
-    def act(self) -> int:
+    def act(self, uniform: float = None) -> int:
         """
         Choose an action with a probability p.
 
+        :param uniform: [optional] A uniform draw in [0, 1), cooperating if it is below the probability of cooperation.
+        Default: the action is drawn with the global numpy generator.
         :return: The action choosen.
         """
-        return np.random.choice([0, 1], p=self.proba)
+        if uniform is None:
+            return np.random.choice([0, 1], p=self.proba)
+        return 0 if uniform < self.proba[0] else 1
 
     def get_aspiration(self) -> int:
         """
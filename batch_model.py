@@ -0,0 +1,361 @@
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy
+from numpy import ndarray
+from numpy.random import Generator
+
+from checkpoint import Checkpoint
+from matrix_payoffs import Matrix_Payoffs
+from random_streams import Uniform_Stream, spawn_generators
+from reducers import Reducer
+from training_result import Training_Result
+
+# Maximum number of values computed at once when filling the trajectories of absorbed repetitions
+FILL_CHUNK_SIZE = 1 << 22
+# Proportion of active lanes below which only the active lanes are simulated
+COMPACTION_THRESHOLD = 0.5
+# Number of episodes between two detections of the locked lanes
+DETECTION_INTERVAL = 16
+
+
+class Batch_Bush_Mosteller:
+    def __init__(self, game: Union[Matrix_Payoffs, Sequence[Matrix_Payoffs]], nb_repetitions: int, learning_rate=0.5,
+                 aspiration=2, habituation=0, probab_init=0.5, generators: Optional[List[Generator]] = None,
+                 absorbing_tolerance: Optional[float] = None):
+        """
+        Runs every repetition of the Bush-Mosteller model at once. The state of all the agents is kept in arrays of
+        shape (repetitions, agents) instead of one Agent object per agent and per repetition.
+
+        Several parameter sets can be simulated in lockstep by giving a sequence of games and/or sequences of
+        parameters: they are stacked along a leading axis and the state arrays become (sets, repetitions, agents).
+        Internally, each (parameter set, repetition) pair is a lane of arrays of shape (lanes, agents). The agents of
+        a pair may also have their own parameters, given as arrays of shape (sets, agents), e.g. a fast learner
+        against a slow one.
+
+        With an absorbing tolerance, a repetition where every agent plays one action with a probability of at least
+        1 - tolerance, and where that outcome gives no agent a negative stimulus, is considered locked in a
+        self-reinforcing equilibrium. The other actions are neglected from then on: the rest of its trajectory follows
+        from the geometric convergence of the update under a constant outcome and no more random numbers are drawn
+        for it. The trajectories must then be recorded, as reducers would need the state of every lane at every
+        episode.
+
+        :param game: The game to be played, or one game per parameter set
+        :param nb_repetitions: Number of repetitions simulated together
+        :param learning_rate: l, one value per parameter set, or one value per parameter set and agent
+        :param aspiration: A, one value per parameter set, or one value per parameter set and agent
+        :param habituation: h, one value per parameter set, or one value per parameter set and agent
+        :param probab_init: Initial probability of cooperation, one value per parameter set, or one value per
+        parameter set and agent
+        :param generators: [optional] The random stream of each repetition, shared by all the parameter sets. Default:
+        new unseeded streams
+        :param absorbing_tolerance: [optional] Tolerance of the detection of locked repetitions. Default: None, every
+        repetition is simulated until the end
+        """
+        games = [game] if isinstance(game, Matrix_Payoffs) else list(game)
+        self.game = games[0]
+        kernels = [g.kernel for g in games]
+        game_index = numpy.arange(len(games))
+        tables = numpy.asarray([kernel.table for kernel in kernels])
+        bounds = numpy.asarray([(kernel.high, kernel.low) for kernel in kernels], dtype=numpy.float64)
+        if isinstance(game, Matrix_Payoffs):
+            game_index, tables, bounds = game_index[0], tables[0], bounds[0]
+        nb_agents = self.game.num_agents
+        # Every parameter is made of shape (sets, 1) or (sets, agents), to be broadcast against the agents axis
+        parameters = [numpy.asarray(value, dtype=numpy.float64)
+                      for value in (learning_rate, aspiration, habituation, probab_init)]
+        parameters = [value if value.ndim == 2 else value[..., numpy.newaxis] for value in parameters]
+        if any(value.ndim > 2 or value.shape[-1] not in (1, nb_agents) for value in parameters):
+            raise ValueError("Parameters must be given as scalars, one value per parameter set, or arrays of shape "
+                             "(sets, agents)")
+        self.batch_shape = numpy.broadcast_shapes(game_index.shape, *(value.shape[:-1] for value in parameters))
+        if len(self.batch_shape) > 1:
+            raise ValueError("Parameter sets must be given as scalars or one dimensional sequences")
+
+        self.shape = self.batch_shape + (nb_repetitions, nb_agents)
+        self.lane_shape = self.batch_shape + (nb_repetitions,)
+        nb_sets = int(numpy.prod(self.batch_shape, dtype=numpy.int64))
+        set_index = numpy.repeat(numpy.arange(nb_sets), nb_repetitions)
+        self.repetition = numpy.tile(numpy.arange(nb_repetitions), nb_sets)
+
+        # Parameters are given per lane, of shape (lanes, 1) or (lanes, agents)
+        self.leara, aspiration, self.habi, probab_init = [
+            numpy.broadcast_to(value, self.batch_shape + value.shape[-1:]).reshape(-1, value.shape[-1])[set_index]
+            for value in parameters]
+        self.habituates = bool(numpy.any(self.habi != 0))
+        self.table = numpy.broadcast_to(tables, self.batch_shape + (4, nb_agents)).reshape(-1, nb_agents)
+        self.table_offset = set_index * 4
+        self.high, self.low = [numpy.broadcast_to(bounds[..., i], self.batch_shape).reshape(-1)[set_index, None]
+                               for i in range(2)]
+        self.proba = numpy.broadcast_to(probab_init, (len(set_index), nb_agents)).copy()
+        self.proba_defect = 1 - self.proba
+        self.aspi = numpy.broadcast_to(aspiration, (len(set_index), nb_agents)).copy()
+        self.supremum = self.get_supremum(self.aspi)
+        self.stimulus_table = None
+        if not self.habituates:
+            # The aspirations never change, so the stimuli of each outcome are taken from the tables of the games, the
+            # column of each agent being computed with its own aspiration
+            set_aspirations = numpy.broadcast_to(parameters[1], self.batch_shape + (nb_agents,)).reshape(-1, nb_agents)
+            set_games = numpy.broadcast_to(game_index, self.batch_shape).reshape(-1)
+            self.stimulus_table = numpy.concatenate([
+                numpy.stack([kernels[g].get_stimulus_table(a[agent])[:, agent] for agent in range(nb_agents)], axis=1)
+                for g, a in zip(set_games, set_aspirations)])
+        if generators is None:
+            generators = spawn_generators(None, 0, nb_repetitions)
+        self.uniforms = Uniform_Stream(generators, nb_agents)
+
+        self.absorbing_tolerance = absorbing_tolerance
+        self.active = numpy.arange(len(set_index))
+        self.absorbed = numpy.empty(0, dtype=numpy.int64)
+        self.absorbed_actions = numpy.empty((0, nb_agents), dtype=numpy.intp)
+        self.result = None
+
+    def get_supremum(self, aspi: ndarray, lanes: Union[ndarray, slice] = slice(None)) -> ndarray:
+        """
+        :param aspi: Array of aspirations of shape (lanes, ...)
+        :param lanes: [optional] The indices of the lanes. Default: all the lanes
+        :return: The denominator of the stimuli formula for each aspiration, as in game_kernel.Game_Kernel
+        """
+        high, low = self.high[lanes], self.low[lanes]
+        if aspi.ndim > high.ndim:
+            high, low = high[..., numpy.newaxis], low[..., numpy.newaxis]
+        return numpy.ceil(numpy.maximum(high - aspi, aspi - low))
+
+    def get_payoffs(self, actions: ndarray, lanes: Union[ndarray, slice] = slice(None)) -> ndarray:
+        """
+        :param actions: Array of shape (lanes, agents) containing the actions of the agents
+        :param lanes: [optional] The indices of the lanes. Default: all the lanes
+        :return: Array of the same shape where each element is the reward of the corresponding agent
+        """
+        return self.table[self.table_offset[lanes] + actions[:, 0] * 2 + actions[:, 1]]
+
+    def query_next_actions(self, lanes: Union[ndarray, slice] = slice(None)) -> ndarray:
+        """
+        Draws the next action of every agent in the given lanes
+        :param lanes: [optional] The indices of the lanes. Default: all the lanes
+        :return: An array of shape (lanes, agents) where 0 is cooperation and 1 is defection
+        """
+        uniforms = self.uniforms.next()[self.repetition[lanes]]
+        return (uniforms >= self.proba[lanes]).astype(numpy.intp)
+
+    def update(self, actions: ndarray, lanes: Union[ndarray, slice] = slice(None)) -> ndarray:
+        """
+        Plays the given actions in the given lanes and applies the Bush-Mosteller update
+        :param actions: The actions, of shape (lanes, agents)
+        :param lanes: [optional] The indices of the lanes. Default: all the lanes
+        :return: The stimuli, of shape (lanes, agents)
+        """
+        outcomes = self.table_offset[lanes] + actions[:, 0] * 2 + actions[:, 1]
+        if self.stimulus_table is not None:
+            stimuli = self.stimulus_table[outcomes]
+        else:
+            payoffs = self.table[outcomes]
+            aspi = self.aspi[lanes]
+            stimuli = (payoffs - aspi) / self.supremum[lanes]
+            habi = self.habi[lanes]
+            self.aspi[lanes] = (1 - habi) * aspi + habi * payoffs
+            self.supremum[lanes] = self.get_supremum(self.aspi[lanes], lanes)
+
+        cooperate = actions == 0
+        leara = self.leara[lanes]
+        chosen = numpy.where(cooperate, self.proba[lanes], self.proba_defect[lanes])
+        newprob = numpy.where(stimuli >= 0, chosen + (1 - chosen) * leara * stimuli, chosen + chosen * leara * stimuli)
+        self.proba[lanes] = numpy.where(cooperate, newprob, 1 - newprob)
+        self.proba_defect[lanes] = numpy.where(cooperate, 1 - newprob, newprob)
+        return stimuli
+
+    def run_episode(self) -> Tuple[ndarray, ndarray, ndarray, ndarray]:
+        """
+        Runs a single episode of the game in every repetition
+        :return: A tuple containing: The probabilities of cooperation, the stimuli, the aspirations and the actions of
+        the agents, each of shape (..., repetitions, agents)
+        """
+        actions = self.query_next_actions()
+        stimuli = self.update(actions)
+        return (self.proba.reshape(self.shape), stimuli.reshape(self.shape), self.aspi.reshape(self.shape),
+                actions.reshape(self.shape))
+
+    def get_state(self) -> Dict[str, Union[ndarray, str]]:
+        """
+        :return: The state of every lane and of the random streams, to be restored by set_state
+        """
+        state = {"proba": self.proba, "proba_defect": self.proba_defect, "aspi": self.aspi, "supremum": self.supremum}
+        state.update({"random_" + name: value for name, value in self.uniforms.get_state().items()})
+        return state
+
+    def set_state(self, state: Dict[str, Union[ndarray, str]]) -> None:
+        """
+        Restores a state returned by get_state
+        """
+        for name in ("proba", "proba_defect", "aspi", "supremum"):
+            getattr(self, name)[...] = state[name]
+        self.uniforms.set_state({name[len("random_"):]: value for name, value in state.items()
+                                 if name.startswith("random_")})
+
+    def run(self, nb_runs: int, out: Optional[Training_Result] = None, reducers: Sequence[Reducer] = (),
+            record: bool = True, checkpoint: Optional[Checkpoint] = None) -> None:
+        """
+        Runs the given number of episodes in every repetition
+        :param nb_runs: Number of episodes
+        :param out: [optional] Result of shape (..., repetitions, agents, episodes) where the trajectories are written.
+        Default: a new result is allocated
+        :param reducers: [optional] Reducers updated with the data of every episode
+        :param record: False to only update the reducers, without keeping the trajectories. Default: True
+        :param checkpoint: [optional] Checkpoint whose result is written, restored if it holds a state and saved when
+        due. Requires an exact run without reducers. Default: None
+        """
+        start = 0
+        if checkpoint is not None:
+            if self.absorbing_tolerance is not None or reducers:
+                raise ValueError("Checkpoints require an exact run without reducers")
+            out = checkpoint.result
+            if checkpoint.state is not None:
+                self.set_state(checkpoint.state)
+                start = checkpoint.progress
+        if record:
+            self.result = Training_Result.allocate(self.shape + (nb_runs,)) if out is None else out
+        if self.absorbing_tolerance is not None:
+            if reducers or not record:
+                raise ValueError("Absorbing runs must record the trajectories and cannot update reducers")
+            self.run_absorbing(nb_runs)
+            return
+        for reducer in reducers:
+            reducer.start(self.batch_shape, nb_runs)
+        if record:
+            action_probabilities, aspirations, stimuli, action = self.result.as_tuple()
+        for i in range(start, nb_runs):
+            proba, stim, aspi, actions = self.run_episode()
+            if record:
+                action_probabilities[..., i], stimuli[..., i], aspirations[..., i], action[..., i] = (proba, stim, aspi,
+                                                                                                     actions)
+            if reducers:
+                values = {"act_probs": proba, "asp": aspi, "stim": stim, "actions": actions}
+                for reducer in reducers:
+                    reducer.update(i, values)
+            if checkpoint is not None and i < nb_runs - 1 and checkpoint.due():
+                checkpoint.save(i + 1, self.get_state())
+
+    def run_absorbing(self, nb_runs: int) -> None:
+        """
+        Same as run, detecting the locked lanes every DETECTION_INTERVAL episodes. Locked lanes are first advanced with
+        their locked actions along with the others. Once they make most of the lanes, only the active lanes are
+        simulated and the trajectories of the locked ones are filled at once in closed form.
+        """
+        compacted = False
+        for i in range(nb_runs):
+            if compacted:
+                if not len(self.active):
+                    break
+                actions = self.query_next_actions(self.active)
+                stimuli = self.update(actions, self.active)
+                self.write(self.active, i, stimuli, actions)
+            else:
+                actions = self.query_next_actions()
+                actions[self.absorbed] = self.absorbed_actions
+                stimuli = self.update(actions)
+                self.write(slice(None), i, stimuli, actions)
+            if i == nb_runs - 1 or not len(self.active) or (i + 1) % DETECTION_INTERVAL:
+                continue
+            self.absorb(i + 1, nb_runs, compacted)
+            if not compacted and len(self.active) <= COMPACTION_THRESHOLD * len(self.proba):
+                compacted = True
+                self.fill(self.absorbed, self.absorbed_actions, i + 1, nb_runs)
+
+    def write(self, lanes: ndarray, episode: int, stimuli: ndarray, actions: ndarray) -> None:
+        """
+        Writes the state of the given lanes after an episode in the recorded trajectories
+        """
+        if isinstance(lanes, slice):
+            index = (Ellipsis, episode)
+            stimuli, actions = stimuli.reshape(self.shape), actions.reshape(self.shape)
+        else:
+            index = numpy.unravel_index(lanes, self.lane_shape) + (slice(None), episode)
+        self.result.action_probabilities[index] = self.proba[lanes].reshape(stimuli.shape)
+        self.result.aspirations[index] = self.aspi[lanes].reshape(stimuli.shape)
+        self.result.stimuli[index] = stimuli
+        self.result.actions[index] = actions
+
+    def absorb(self, start: int, nb_runs: int, fill: bool) -> None:
+        """
+        Stops drawing the actions of the active lanes that are locked in a self-reinforcing equilibrium
+        :param start: Index of the next episode
+        :param nb_runs: Number of episodes of the run
+        :param fill: True to fill the rest of the trajectories of the newly locked lanes
+        """
+        lanes = self.active
+        proba = self.proba[lanes]
+        locked_actions = (proba <= self.absorbing_tolerance).astype(numpy.intp)
+        locked = locked_actions.astype(bool) | (proba >= 1 - self.absorbing_tolerance)
+        reinforced = self.get_payoffs(locked_actions, lanes) >= self.aspi[lanes]
+        absorbed = numpy.all(locked & reinforced, axis=1)
+        if not absorbed.any():
+            return
+        if fill:
+            self.fill(lanes[absorbed], locked_actions[absorbed], start, nb_runs)
+        self.absorbed = numpy.concatenate([self.absorbed, lanes[absorbed]])
+        self.absorbed_actions = numpy.concatenate([self.absorbed_actions, locked_actions[absorbed]])
+        self.active = lanes[~absorbed]
+        self.uniforms.active = numpy.zeros(len(self.uniforms.generators), dtype=bool)
+        self.uniforms.active[self.repetition[self.active]] = True
+
+    def fill(self, lanes: ndarray, actions: ndarray, start: int, nb_runs: int) -> None:
+        """
+        Fills the trajectories of locked lanes from the given episode to the end of the run. Under a constant outcome
+        the aspirations converge geometrically to the payoffs, A_k = P + (A_0 - P) * (1 - h)^k, and the probability
+        of the action that is not played is multiplied by 1 - l * s_k at each episode.
+        :param lanes: The indices of the lanes
+        :param actions: Their locked actions, of shape (lanes, agents)
+        :param start: Index of the first episode to fill
+        :param nb_runs: Number of episodes of the run
+        """
+        steps = numpy.arange(nb_runs - start + 1)
+        chunk = max(1, FILL_CHUNK_SIZE // (len(steps) * actions.shape[1]))
+        for first in range(0, len(lanes), chunk):
+            part, part_actions = lanes[first:first + chunk], actions[first:first + chunk]
+            payoffs = self.get_payoffs(part_actions, part)[..., numpy.newaxis]
+            if self.habituates:
+                decay = (1 - self.habi[part][..., numpy.newaxis]) ** steps
+                aspirations = payoffs + (self.aspi[part][..., numpy.newaxis] - payoffs) * decay
+                supremum = self.get_supremum(aspirations[..., :-1], part)
+            else:
+                aspirations = numpy.broadcast_to(self.aspi[part][..., numpy.newaxis], payoffs.shape[:-1] + steps.shape)
+                supremum = self.supremum[part][..., numpy.newaxis]
+            stimuli = numpy.broadcast_to((payoffs - aspirations[..., :-1]) / supremum, aspirations[..., 1:].shape)
+            cooperate = part_actions == 0
+            other = numpy.where(cooperate, self.proba_defect[part], self.proba[part])[..., numpy.newaxis]
+            other = other * numpy.cumprod(1 - self.leara[part][..., numpy.newaxis] * stimuli, axis=-1)
+            proba = numpy.where(cooperate[..., numpy.newaxis], 1 - other, other)
+
+            index = numpy.unravel_index(part, self.lane_shape) + (slice(None), slice(start, nb_runs))
+            self.result.action_probabilities[index] = proba
+            self.result.aspirations[index] = aspirations[..., 1:]
+            self.result.stimuli[index] = stimuli
+            self.result.actions[index] = part_actions[..., numpy.newaxis]
+
+            self.aspi[part] = aspirations[..., -1]
+            self.proba[part] = proba[..., -1]
+            self.proba_defect[part] = 1 - proba[..., -1]
+
+    def get_aspirations(self) -> ndarray:
+        """
+        :return: Array of shape (..., repetitions, agents, episodes) containing the aspirations during training
+        """
+        return self.result.aspirations
+
+    def get_action_probabilities(self) -> ndarray:
+        """
+        :return: Array of shape (..., repetitions, agents, episodes) containing the probabilities of cooperation during
+        training
+        """
+        return self.result.action_probabilities
+
+    def get_stimuli_agent(self) -> ndarray:
+        """
+        :return: Array of shape (..., repetitions, agents, episodes) containing the stimuli during training
+        """
+        return self.result.stimuli
+
+    def get_action(self) -> ndarray:
+        """
+        :return: Array of shape (..., repetitions, agents, episodes) containing the actions taken during training
+        """
+        return self.result.actions
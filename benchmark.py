@@ -0,0 +1,262 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import numpy
+from numpy import ndarray
+
+from population import Population_Bush_Mosteller
+from random_streams import spawn_generators
+from result_store import make_key
+from runner import get_game, read_data, save_data, train, train_sweep
+
+# (repetitions, episodes) of the trainings timed by each preset
+SIZES = {"quick": [(100, 500), (1000, 500)],
+         "full": [(100, 500), (1000, 500), (1000, 5000), (10000, 1000)]}
+# Numbers of parameter sets trained in lockstep by the sweep cases
+SWEEP_WIDTHS = {"quick": [4], "full": [4, 16]}
+# Numbers of agents of the population cases
+POPULATION_SIZES = {"quick": [10 ** 4], "full": [10 ** 4, 10 ** 6]}
+# Largest number of repetitions times episodes timed with the classic engine, which is much slower than the others
+CLASSIC_MAX_WORK = 500000
+# Parameters of the timed trainings: h, A, l
+PARAMETERS = (0.2, 2, 0.5)
+# Significance level of the equivalence checks
+ALPHA = 0.001
+
+
+def build_cases(preset: str, games: List[str], modes: List[str]) -> List[Dict]:
+    """
+    :param preset: "quick" or "full"
+    :param games: The games timed
+    :param modes: The modes timed
+    :return: The benchmark cases, each one being a dictionary describing what is timed
+    """
+    cases = []
+    for game in games:
+        for mode in modes:
+            for nb_repetitions, nb_episodes in SIZES[preset]:
+                size = dict(game=game, mode=mode, reps=nb_repetitions, eps=nb_episodes)
+                if nb_repetitions * nb_episodes <= CLASSIC_MAX_WORK:
+                    cases.append(dict(kind="train", engine="classic", **size))
+                cases.append(dict(kind="train", engine="batch", **size))
+                cases += [dict(kind="sweep", sets=width, **size) for width in SWEEP_WIDTHS[preset]]
+                cases.append(dict(kind="store", **size))
+            cases += [dict(kind="population", game=game, mode=mode, agents=nb_agents, eps=100)
+                      for nb_agents in POPULATION_SIZES[preset]]
+    for case in cases:
+        case["name"] = "_".join(str(case[field]) for field in ("kind", "engine", "game", "mode", "reps", "agents",
+                                                                "sets", "eps") if field in case)
+    return cases
+
+
+def run_case(case: Dict) -> Dict:
+    """
+    Times a benchmark case. Meant to be called in a fresh process, so that the peak memory is the one of the case
+    :param case: The case, as returned by build_cases
+    :return: The seconds taken, the number of episodes simulated per second, the peak resident memory in megabytes and
+    the bytes written
+    """
+    game = get_game(case["game"], case["mode"])
+    habituation, aspiration, learning_rate = PARAMETERS
+    measures = dict(bytes_written=0)
+    start = time.perf_counter()
+    if case["kind"] == "train":
+        train(game, habituation, aspiration, learning_rate, case["reps"], case["eps"], engine=case["engine"], seed=0)
+        episodes = case["reps"] * case["eps"]
+    elif case["kind"] == "sweep":
+        sets = case["sets"]
+        train_sweep([game] * sets, [habituation] * sets, numpy.linspace(0.5, 3.5, sets), [learning_rate] * sets,
+                    case["reps"], case["eps"], seed=0)
+        episodes = sets * case["reps"] * case["eps"]
+    elif case["kind"] == "population":
+        model = Population_Bush_Mosteller(game, case["agents"], learning_rate, aspiration, habituation,
+                                          rng=spawn_generators(0, 0, 1)[0])
+        model.run(case["eps"])
+        episodes = case["agents"] // 2 * case["eps"]
+    else:
+        result = train(game, habituation, aspiration, learning_rate, case["reps"], case["eps"], engine="batch", seed=0)
+        root = tempfile.mkdtemp(prefix="benchmark_")
+        try:
+            start = time.perf_counter()
+            save_data(make_key(case["game"], case["mode"], *PARAMETERS, case["reps"], case["eps"]), result, root)
+            measures["write_seconds"] = time.perf_counter() - start
+            read = time.perf_counter()
+            numpy.asarray(read_data(case["game"], case["mode"], *PARAMETERS, case["reps"], case["eps"],
+                                    root=root)[:, 0])
+            measures["read_seconds"] = time.perf_counter() - read
+            measures["bytes_written"] = sum(os.path.getsize(os.path.join(folder, name))
+                                            for folder, _, names in os.walk(root) for name in names)
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+        episodes = case["reps"] * case["eps"]
+    measures["seconds"] = time.perf_counter() - start
+    measures["episodes_per_sec"] = episodes / measures["seconds"]
+    # ru_maxrss is given in kilobytes on Linux
+    measures["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return measures
+
+
+def measure(case: Dict, repeat: int = 1) -> Dict:
+    """
+    :param case: The case, as returned by build_cases
+    :param repeat: Number of times the case is timed, each time in a new process. Default: 1
+    :return: The measures of the fastest run
+    """
+    context = multiprocessing.get_context("spawn")
+    runs = []
+    for _ in range(repeat):
+        with context.Pool(1, maxtasksperchild=1) as pool:
+            runs.append(pool.apply(run_case, (case,)))
+    return max(runs, key=lambda run: run["episodes_per_sec"])
+
+
+def ks_statistic(sample_a: ndarray, sample_b: ndarray) -> float:
+    """
+    :return: The two-sample Kolmogorov-Smirnov statistic, i.e. the largest distance between the empirical
+    distribution functions of the samples
+    """
+    sample_a, sample_b = numpy.sort(sample_a), numpy.sort(sample_b)
+    values = numpy.concatenate([sample_a, sample_b])
+    cdf_a = numpy.searchsorted(sample_a, values, side="right") / len(sample_a)
+    cdf_b = numpy.searchsorted(sample_b, values, side="right") / len(sample_b)
+    return float(numpy.max(numpy.abs(cdf_a - cdf_b)))
+
+
+def ks_critical_value(size_a: int, size_b: int, alpha: float = ALPHA) -> float:
+    """
+    :return: The value of the statistic above which the samples are unlikely to come from the same distribution
+    """
+    return math.sqrt(-math.log(alpha / 2) / 2) * math.sqrt((size_a + size_b) / (size_a * size_b))
+
+
+def check_equivalence(game_name: str, mode: str, nb_repetitions: int = 2000, nb_episodes: int = 200,
+                      alpha: float = ALPHA) -> List[Dict]:
+    """
+    Compares the distribution of the probabilities of cooperation given by every engine with the one of the reference
+    Bush_Mosteller model, at the middle and at the end of the training. The engines draw from other seeds than the
+    reference, so that the samples are independent.
+    :param game_name: "PD", "CH" or "SG"
+    :param mode: "classic", "fear" or "greed"
+    :param nb_repetitions: Number of repetitions of each sample
+    :param nb_episodes: Number of episodes
+    :param alpha: Significance level of the Kolmogorov-Smirnov tests. Default: ALPHA
+    :return: The statistic, the critical value and the verdict of every engine and episode
+    """
+    game = get_game(game_name, mode)
+    habituation, aspiration, learning_rate = PARAMETERS
+    reference = train(game, *PARAMETERS, nb_repetitions, nb_episodes, engine="classic", seed=1).action_probabilities
+    population = Population_Bush_Mosteller(game, 2 * nb_repetitions, learning_rate, aspiration, habituation,
+                                           edges=numpy.arange(2 * nb_repetitions).reshape(-1, 2),
+                                           rng=spawn_generators(2, 0, 1)[0])
+    population.run(nb_episodes, record=True)
+    samples = {
+        "batch": train(game, *PARAMETERS, nb_repetitions, nb_episodes, engine="batch", seed=2).action_probabilities,
+        "batch_absorbing": train(game, *PARAMETERS, nb_repetitions, nb_episodes, engine="batch", seed=3,
+                                 absorbing_tolerance=1e-9).action_probabilities,
+        "sweep": train_sweep([game] * 2, [habituation, 0], [aspiration, 1], [learning_rate] * 2, nb_repetitions,
+                             nb_episodes, seed=4).action_probabilities[0],
+        "population": population.get_action_probabilities().reshape(nb_repetitions, 2, nb_episodes)}
+    checks = []
+    for engine, sample in samples.items():
+        for episode in (nb_episodes // 2 - 1, nb_episodes - 1):
+            statistic = ks_statistic(reference[:, 0, episode], sample[:, 0, episode])
+            critical = ks_critical_value(nb_repetitions, nb_repetitions, alpha)
+            checks.append(dict(game=game_name, mode=mode, engine=engine, episode=episode, statistic=statistic,
+                               critical=critical, passed=statistic <= critical))
+    return checks
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, float], tolerance: float) -> List[str]:
+    """
+    :param results: The measures of every case, by name
+    :param baseline: The number of episodes per second of every case, by name
+    :param tolerance: The relative slowdown allowed
+    :return: A message for every case slower than its baseline by more than the tolerance
+    """
+    regressions = []
+    for name, measures in results.items():
+        if name in baseline and measures["episodes_per_sec"] < baseline[name] * (1 - tolerance):
+            regressions.append("{0}: {1:.0f} episodes/sec, baseline {2:.0f} (-{3:.0%})".format(
+                name, measures["episodes_per_sec"], baseline[name], 1 - measures["episodes_per_sec"] / baseline[name]))
+    return regressions
+
+
+def get_commit() -> Optional[str]:
+    """
+    :return: The current git commit, None outside of a repository
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Times the engines and the result store")
+    parser.add_argument("--preset", choices=tuple(SIZES), default="quick")
+    parser.add_argument("--games", nargs="+", default=["PD"])
+    parser.add_argument("--modes", nargs="+", default=["classic"])
+    parser.add_argument("--repeat", type=int, default=1, help="Number of timings per case, the fastest is kept")
+    parser.add_argument("--history", default="benchmarks/history.json")
+    parser.add_argument("--baseline", default="benchmarks/baseline.json")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Relative slowdown allowed against the baseline")
+    parser.add_argument("--check", action="store_true", help="Check the output distribution of every engine")
+    args = parser.parse_args()
+
+    results = dict()
+    cases = build_cases(args.preset, args.games, args.modes)
+    for count, case in enumerate(cases, 1):
+        results[case["name"]] = measures = measure(case, args.repeat)
+        print("({0}/{1}) {2}: {3:.2f}s {4:.0f} episodes/sec {5:.0f}MB peak {6}B written".format(
+            count, len(cases), case["name"], measures["seconds"], measures["episodes_per_sec"],
+            measures["peak_rss_mb"], measures["bytes_written"]))
+
+    checks = []
+    if args.check:
+        for game in args.games:
+            for mode in args.modes:
+                checks += check_equivalence(game, mode)
+        for check in checks:
+            print("{0} {1} {2} episode {3}: KS {4:.4f} (critical {5:.4f}) {6}".format(
+                check["game"], check["mode"], check["engine"], check["episode"], check["statistic"],
+                check["critical"], "ok" if check["passed"] else "FAILED"))
+
+    os.makedirs(os.path.dirname(args.history) or ".", exist_ok=True)
+    history = []
+    if os.path.exists(args.history):
+        with open(args.history, "r") as source:
+            history = json.load(source)
+    history.append(dict(time=time.time(), commit=get_commit(), preset=args.preset, results=results, checks=checks))
+    with open(args.history, "w") as dest:
+        json.dump(history, dest, indent=1)
+
+    regressions = []
+    if args.save_baseline:
+        with open(args.baseline, "w") as dest:
+            json.dump({name: measures["episodes_per_sec"] for name, measures in results.items()}, dest, indent=1,
+                      sort_keys=True)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, "r") as source:
+            regressions = compare(results, json.load(source), args.tolerance)
+    for regression in regressions:
+        print("REGRESSION " + regression, file=sys.stderr)
+    failed = [check for check in checks if not check["passed"]]
+    if failed:
+        print("{0} engine checks FAILED".format(len(failed)), file=sys.stderr)
+    return 1 if regressions or failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
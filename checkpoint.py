@@ -0,0 +1,168 @@
+import json
+import os
+import time
+from typing import Dict, List, Optional, Set, Tuple, Union
+
+import numpy
+from numpy import ndarray
+
+from result_store import DATA_TYPES, Result_Store, entry_name
+
+# Minimum number of seconds between two checkpoints of a training
+CHECKPOINT_INTERVAL = 60
+# Fraction of the run time spent saving checkpoints at most, the interval growing with the cost of a checkpoint
+CHECKPOINT_OVERHEAD = 0.02
+
+
+class Sweep_Journal:
+    def __init__(self, root: str = "data/"):
+        """
+        Append-only record of the trainings of a sweep that are done, one JSON object per line. Every line is
+        flushed to disk when written, so the journal survives a crash of the process writing it.
+
+        :param root: The folder of the result store. Default: "data/"
+        """
+        self.path = os.path.join(root, "journal.jsonl")
+
+    def record(self, key: Dict, seed: int) -> None:
+        """
+        Records that a training is done and saved in the store
+        :param key: The key of the training
+        :param seed: The root seed of the training
+        """
+        with open(self.path, "a") as journal:
+            journal.write(json.dumps({"entry": entry_name(key), "seed": seed}) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+
+    def get_done(self, seed: int) -> Set[str]:
+        """
+        :param seed: The root seed of the sweep
+        :return: The names of the entries done with the given seed
+        """
+        if not os.path.exists(self.path):
+            return set()
+        done = set()
+        with open(self.path, "r") as journal:
+            for line in journal:
+                # The last line may be incomplete if the process crashed while writing it
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if event["seed"] == seed:
+                    done.add(event["entry"])
+        return done
+
+
+class Checkpoint:
+    def __init__(self, key: Dict, nb_agents: int, seed: int, engine: str, interval: float = CHECKPOINT_INTERVAL,
+                 root: str = "data/"):
+        """
+        Periodic checkpoints of a training written directly to the temporary files of its store entry. A checkpoint
+        flushes the trajectories computed so far and saves the progress of the training, with the state of the
+        engine if it has one, in [entry]/checkpoint.npz. A checkpoint left by an interrupted training with the same
+        seed and engine is restored, the training continuing from there.
+
+        Checkpoints are saved when due: at least interval seconds after the previous one, and late enough that saving
+        them takes at most CHECKPOINT_OVERHEAD of the run time.
+
+        :param key: The key of the training
+        :param nb_agents: Number of agents
+        :param seed: The root seed of the training, needed to draw the same random streams after a restart
+        :param engine: Identifier of the engine and of its version, a checkpoint of another engine being ignored
+        :param interval: Minimum number of seconds between two checkpoints. Default: CHECKPOINT_INTERVAL
+        :param root: The folder of the result store. Default: "data/"
+        """
+        self.store = Result_Store(root)
+        self.key = key
+        self.nb_agents = nb_agents
+        self.seed = seed
+        self.engine = engine
+        self.interval = interval
+        self.path = os.path.join(root, entry_name(key), "checkpoint.npz")
+        self.progress = 0
+        self.state: Optional[Dict[str, ndarray]] = None
+        self.load()
+        self.result = self.store.allocate(key, nb_agents, reopen=self.progress > 0)
+        self.cost = 0.0
+        self.last = time.perf_counter()
+
+    def load(self) -> None:
+        """
+        Restores the progress and the state of a previous checkpoint of the same training, if any
+        """
+        files = [self.store.get_path(self.key, data_type) + ".tmp" for data_type in DATA_TYPES]
+        if not os.path.exists(self.path) or not all(os.path.exists(path) for path in files):
+            return
+        with numpy.load(self.path) as checkpoint:
+            if int(checkpoint["seed"]) != self.seed or str(checkpoint["engine"]) != self.engine:
+                return
+            self.progress = int(checkpoint["progress"])
+            self.state = {name: checkpoint[name] for name in checkpoint.files
+                          if name not in ("seed", "engine", "progress")} or None
+
+    def due(self) -> bool:
+        """
+        :return: True if a checkpoint should be saved now
+        """
+        return time.perf_counter() - self.last >= max(self.interval, self.cost / CHECKPOINT_OVERHEAD)
+
+    def save(self, progress: int, state: Optional[Dict[str, Union[ndarray, str]]] = None) -> None:
+        """
+        Flushes the trajectories and saves the progress of the training
+        :param progress: What is done, e.g. the number of episodes or of repetitions whose trajectories are written
+        :param state: [optional] The state of the engine needed to continue from there. Default: None, no state
+        """
+        start = time.perf_counter()
+        for data in self.result.as_tuple():
+            data.flush()
+        temporary = self.path + ".tmp.npz"
+        numpy.savez(temporary, seed=self.seed, engine=self.engine, progress=progress, **(state or {}))
+        os.replace(temporary, self.path)
+        self.progress = progress
+        self.last = time.perf_counter()
+        self.cost = self.last - start
+
+    def complete(self, **metadata) -> None:
+        """
+        Publishes the trajectories of the finished training, registers it in the manifest, removes the checkpoint and
+        records the training in the journal of the sweep
+        :param metadata: [optional] Additional fields of the entry
+        """
+        for data in self.result.as_tuple():
+            data.flush()
+        self.result = None
+        self.store.publish(self.key)
+        self.store.register(self.key, self.nb_agents, seed=self.seed, **metadata)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        Sweep_Journal(self.store.root).record(self.key, self.seed)
+
+
+def get_missing_ranges(store: Result_Store, key: Dict, seed: int, first: int = 0) -> List[Tuple[int, int]]:
+    """
+    Lists the repetitions of a training that are not saved as parts yet, so that an interrupted sweep on a pool of
+    workers only trains the missing chunks. Parts saved with another seed are removed.
+    :param store: The result store
+    :param key: The key of the training
+    :param seed: The root seed of the training
+    :param first: Index of the first repetition to train, e.g. the ones before being already cached. Default: 0
+    :return: The (start, stop) of every range of repetitions to train
+    """
+    seed_path = os.path.join(store.get_parts_folder(key), "seed.json")
+    if os.path.exists(seed_path):
+        with open(seed_path, "r") as source:
+            if json.load(source) != seed:
+                store.remove_parts(key)
+    os.makedirs(store.get_parts_folder(key), exist_ok=True)
+    with open(seed_path, "w") as dest:
+        json.dump(seed, dest)
+    missing = []
+    for start, nb_repetitions in store.list_parts(key):
+        if start > first:
+            missing.append((first, start))
+        first = max(first, start + nb_repetitions)
+    if first < key["nb_repetitions"]:
+        missing.append((first, key["nb_repetitions"]))
+    return missing
@@ -0,0 +1,120 @@
+from typing import Tuple
+
+import numpy
+from numpy import ndarray
+
+from matrix_payoffs import Matrix_Payoffs
+
+
+class Distribution_Solver:
+    def __init__(self, game: Matrix_Payoffs, aspiration: float = 2, learning_rate: float = 0.5,
+                 probab_init: float = 0.5, resolution: int = 201):
+        """
+        Propagates the distribution of the probabilities of cooperation (p1, p2) of a pair of agents instead of
+        sampling repetitions. Without habituation the aspirations never change, so the stimuli only depend on the
+        outcome of the episode and each of the four outcomes moves (p1, p2) to a known point. The distribution is kept
+        on a regular grid of [0, 1]^2 and the mass moved to a point between the nodes is split between the
+        surrounding nodes (bilinear interpolation). The results are free of Monte Carlo noise; the error only depends
+        on the resolution of the grid.
+
+        :param game: The game to be played
+        :param aspiration: A, shared by both agents
+        :param learning_rate: l, shared by both agents
+        :param probab_init: Initial probability of cooperation of both agents
+        :param resolution: Number of grid nodes per agent
+        """
+        self.grid = numpy.linspace(0, 1, resolution)
+        self.leara = learning_rate
+        self.stimuli = game.kernel.get_stimulus_table(aspiration).reshape(2, 2, 2)
+        self.mass = numpy.zeros((resolution, resolution), dtype=numpy.float64)
+        start = probab_init * (resolution - 1)
+        low = min(int(start), resolution - 2)
+        share = [low + 1 - start, start - low]
+        self.mass[low:low + 2, low:low + 2] = numpy.outer(share, share)
+        self.targets, self.weights = self.build_operator()
+        self.marginals = None
+
+    def learn(self, stimu: float, act: int) -> ndarray:
+        """
+        Same update as Agent.learn, applied to every node of the grid
+        :param stimu: The stimulus obtained
+        :param act: The action of the agent
+        :return: The new probability of cooperation of every node
+        """
+        chosen = self.grid if act == 0 else 1 - self.grid
+        if stimu >= 0:
+            newprob = chosen + (1 - chosen) * self.leara * stimu
+        else:
+            newprob = chosen + chosen * self.leara * stimu
+        return newprob if act == 0 else 1 - newprob
+
+    def interpolate(self, values: ndarray) -> Tuple[ndarray, ndarray]:
+        """
+        :param values: Probabilities in [0, 1]
+        :return: The indices of the two surrounding nodes and the share of mass given to each of them, both of shape
+        values.shape + (2,)
+        """
+        position = numpy.clip(values, 0, 1) * (len(self.grid) - 1)
+        low = numpy.minimum(position.astype(numpy.int64), len(self.grid) - 2)
+        share = position - low
+        return numpy.stack([low, low + 1], axis=-1), numpy.stack([1 - share, share], axis=-1)
+
+    def build_operator(self) -> Tuple[ndarray, ndarray]:
+        """
+        Builds the sparse transition operator: every node sends its mass to 4 nodes for each of the 4 outcomes
+        :return: The flat indices of the target nodes and the share of mass sent to each, of shape (nodes, 16)
+        """
+        size = len(self.grid)
+        targets, weights = [], []
+        for act_0 in (0, 1):
+            for act_1 in (0, 1):
+                probability_0 = self.grid if act_0 == 0 else 1 - self.grid
+                probability_1 = self.grid if act_1 == 0 else 1 - self.grid
+                index_0, share_0 = self.interpolate(self.learn(self.stimuli[act_0][act_1][0], act_0))
+                index_1, share_1 = self.interpolate(self.learn(self.stimuli[act_0][act_1][1], act_1))
+                targets.append(index_0[:, None, :, None] * size + index_1[None, :, None, :])
+                weights.append((probability_0[:, None, None, None] * share_0[:, None, :, None])
+                               * (probability_1[None, :, None, None] * share_1[None, :, None, :]))
+        targets = numpy.concatenate([target.reshape(size * size, 4) for target in targets], axis=1)
+        weights = numpy.concatenate([weight.reshape(size * size, 4) for weight in weights], axis=1)
+        return targets, weights
+
+    def run_episode(self) -> None:
+        """
+        Applies the transition operator to the distribution. Only the nodes holding some mass are visited, which are
+        few since the learning dynamics concentrate the mass on a small set of points.
+        """
+        mass = self.mass.ravel()
+        active = numpy.flatnonzero(mass)
+        weights = self.weights[active] * mass[active, None]
+        flat = numpy.bincount(self.targets[active].ravel(), weights=weights.ravel(), minlength=mass.size)
+        self.mass = flat.reshape(self.mass.shape)
+
+    def run(self, nb_runs: int) -> None:
+        """
+        Propagates the distribution over the given number of episodes, keeping the marginal distribution of each
+        agent after every episode
+        :param nb_runs: Number of episodes
+        """
+        self.marginals = numpy.empty((2, nb_runs, len(self.grid)), dtype=numpy.float64)
+        for i in range(nb_runs):
+            self.run_episode()
+            self.marginals[0, i] = self.mass.sum(axis=1)
+            self.marginals[1, i] = self.mass.sum(axis=0)
+
+    def get_mean_cooperation(self) -> ndarray:
+        """
+        :return: Array of shape (agents, episodes) containing the expected probability of cooperation of each agent
+        """
+        return self.marginals @ self.grid
+
+    def get_sre_rate(self, episode: int = None, threshold: float = 0.9, agent: int = 0) -> float:
+        """
+        :param episode: Index of the episode. Default: the episode used by runner.compute_propo_coop_mut
+        :param threshold: The probability of cooperation above which mutual cooperation is reached. Default: 0.9
+        :param agent: The index of the agent. Default: 0, as in runner.compute_propo_coop_mut
+        :return: The probability that the agent cooperates with a probability above the threshold at the episode
+        """
+        if episode is None:
+            episode = 99 if self.marginals.shape[1] < 500 else 499
+        return float(self.marginals[agent, episode, self.grid > threshold].sum())
@@ -0,0 +1,98 @@
+from typing import Dict, List, Sequence, Tuple
+
+import numpy
+from numpy import ndarray
+
+# Payoff vector indices
+T = 0
+R = 1
+P = 2
+S = 3
+# Payoff vector indices by name, for parametric modes such as "T=5,S=-1"
+PAYOFF_NAMES = {"T": T, "R": R, "P": P, "S": S}
+# The payoff changed by the fear and greed modes, and the value given to it when the mode has no parameter
+MODIFIERS = {"fear": (S, -1), "greed": (T, 5)}
+
+
+class Game_Kernel:
+    def __init__(self, payoffs: Sequence[float]):
+        """
+        Flat tables of a game, shared by all the engines. The outcomes are indexed by joint action, a0 * 2 + a1, where
+        0 is cooperation and 1 is defection.
+
+        :param payoffs: The payoff vector [T, R, P, S]
+        """
+        self.vector = tuple(payoffs)
+        # The payoffs of agents 0 and 1 for each outcome, as given to Bush_Mosteller
+        self.outcomes = ((payoffs[R], payoffs[R]), (payoffs[S], payoffs[T]), (payoffs[T], payoffs[S]),
+                         (payoffs[P], payoffs[P]))
+        self.table = numpy.asarray(self.outcomes, dtype=numpy.float64)
+        self.table.flags.writeable = False
+        # max |payoff - aspiration| over the four payoffs is reached at the highest or at the lowest one
+        self.high, self.low = max(payoffs), min(payoffs)
+        self.stimulus_tables: Dict[float, ndarray] = dict()
+
+    def get_supremum(self, aspi):
+        """
+        :param aspi: An aspiration or an array of aspirations
+        :return: The denominator of the stimuli formula for each aspiration, ceil(max(|payoff - aspi|))
+        """
+        return numpy.ceil(numpy.maximum(self.high - aspi, aspi - self.low))
+
+    def get_stimulus_table(self, aspiration: float) -> ndarray:
+        """
+        :param aspiration: A constant aspiration, i.e. without habituation
+        :return: Array of shape (4, 2) of the stimuli of agents 0 and 1 for each outcome, computed once per aspiration
+        """
+        aspiration = float(aspiration)
+        if aspiration not in self.stimulus_tables:
+            table = (self.table - aspiration) / self.get_supremum(aspiration)
+            table.flags.writeable = False
+            self.stimulus_tables[aspiration] = table
+        return self.stimulus_tables[aspiration]
+
+
+# Kernels compiled so far, by payoff vector
+_kernels: Dict[Tuple, Game_Kernel] = dict()
+
+
+def compile_game(payoffs: Sequence[float]) -> Game_Kernel:
+    """
+    :param payoffs: The payoff vector [T, R, P, S]
+    :return: The kernel of the game, compiled once per payoff vector
+    """
+    key = tuple(payoffs)
+    if key not in _kernels:
+        _kernels[key] = Game_Kernel(payoffs)
+    return _kernels[key]
+
+
+def apply_mode(payoffs: List[float], mode: str) -> List[float]:
+    """
+    Applies a mode to a payoff vector. Besides "classic", "fear" (S = -1) and "greed" (T = 5), the modes can set any
+    payoff: "fear=-2" sets S, "greed=6" sets T and "T=5,S=-0.5" sets the payoffs named.
+    :param payoffs: The payoff vector [T, R, P, S] of the classic game
+    :param mode: The mode
+    :return: A new payoff vector
+    """
+    payoffs = list(payoffs)
+    if mode == "classic":
+        return payoffs
+    for assignment in mode.split(","):
+        name, _, value = assignment.partition("=")
+        if name in MODIFIERS:
+            index, default = MODIFIERS[name]
+            payoffs[index] = default if not value else parse_payoff(value)
+        elif name in PAYOFF_NAMES and value:
+            payoffs[PAYOFF_NAMES[name]] = parse_payoff(value)
+        else:
+            raise ValueError(f"Unknown mode: {mode}")
+    return payoffs
+
+
+def parse_payoff(value: str) -> float:
+    """
+    :return: The payoff, as an integer when it is one, so that the usual games keep integer payoffs
+    """
+    number = float(value)
+    return int(number) if number.is_integer() else number
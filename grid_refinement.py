@@ -0,0 +1,110 @@
+import argparse
+from typing import Dict, List, Optional, Tuple
+
+import numpy
+
+from result_store import Result_Store, format_value, make_key
+from runner import compute_propo_coop_mut, train_sweep_by_game
+
+# Aspirations of the coarse grid, from 0 to 4 in steps of 0.5
+COARSE_GRID = [0.5 * i for i in range(9)]
+# Smallest distance between two aspirations of the refined grid
+RESOLUTION = 0.025
+# Change of the SRE rate or of the cooperation level between neighbours above which a midpoint is added
+THRESHOLD = 0.1
+
+
+def get_statistics(agent: numpy.ndarray) -> Tuple[float, float]:
+    """
+    :param agent: The probabilities of cooperation of an agent, of shape (repetitions, episodes)
+    :return: The SRE rate and the mean probability of cooperation at the last episode
+    """
+    return compute_propo_coop_mut(agent), float(numpy.mean(agent[:, -1]))
+
+
+def get_midpoints(statistics: Dict[float, Tuple[float, float]], resolution: float, threshold: float) -> List[float]:
+    """
+    :param statistics: The SRE rate and cooperation level of every aspiration trained so far
+    :param resolution: Smallest distance between two aspirations
+    :param threshold: Change of either statistic between neighbours above which their midpoint is added
+    :return: The midpoints of the neighbours between which a statistic changes sharply
+    """
+    aspirations = sorted(statistics)
+    midpoints = []
+    for low, high in zip(aspirations, aspirations[1:]):
+        changes = numpy.abs(numpy.subtract(statistics[high], statistics[low]))
+        if (high - low) / 2 >= resolution and numpy.max(changes) > threshold:
+            # Rounded so that the key of the midpoint does not depend on floating point noise
+            midpoints.append(round((low + high) / 2, 10))
+    return midpoints
+
+
+def refine(game_name: str, mode: str, habituation: float, learning_rate: float, nb_repetitions: int,
+           nb_episodes: int, coarse_grid: Optional[List[float]] = None, resolution: float = RESOLUTION,
+           threshold: float = THRESHOLD, sweep_size: Optional[int] = None,
+           seed: Optional[int] = None) -> Dict[float, Tuple[float, float]]:
+    """
+    Trains a coarse grid of aspirations, then adds the midpoint of every pair of neighbours whose SRE rate or
+    cooperation level differ by more than the threshold, until the neighbours are closer than twice the resolution.
+    The flat regions of the curve keep the spacing of the coarse grid while the transitions get the resolution. Every
+    round of midpoints is trained as one sweep and saved in the result store, where plot.py reads the irregular grid;
+    the aspirations already stored are not trained again.
+    :param game_name: "PD", "CH" or "SG"
+    :param mode: "classic", "fear", "greed" or a parametric mode
+    :param habituation: h
+    :param learning_rate: l
+    :param nb_repetitions: Number of repetitions of each training
+    :param nb_episodes: Number of episodes of each training
+    :param coarse_grid: [optional] The aspirations trained first. Default: COARSE_GRID
+    :param resolution: Smallest distance between two aspirations. Default: RESOLUTION
+    :param threshold: Change of either statistic between neighbours above which their midpoint is added. Default:
+    THRESHOLD
+    :param sweep_size: [optional] Maximum number of aspirations trained in lockstep. Default: all of a round
+    :param seed: The root seed of every training. Default: None, not reproducible
+    :return: The SRE rate and cooperation level of agent 0 for every aspiration of the refined grid
+    """
+    store = Result_Store()
+    statistics = dict()
+    aspirations = list(COARSE_GRID if coarse_grid is None else coarse_grid)
+    depth = 0
+    while aspirations:
+        parameters_list = [[mode] + [format_value(value) for value in (habituation, aspiration, learning_rate)]
+                           + [str(nb_repetitions), str(nb_episodes)] for aspiration in aspirations]
+        missing = [parameters for parameters in parameters_list if not store.contains(make_key(game_name, *parameters))]
+        print("Refinement: game={0} mode={1} depth={2} points={3} trained={4}".format(
+            game_name, mode, depth, len(aspirations), len(missing)), flush=True)
+        if missing:
+            train_sweep_by_game(missing, game_name, sweep_size, seed)
+        for aspiration, parameters in zip(aspirations, parameters_list):
+            statistics[aspiration] = get_statistics(store.read(make_key(game_name, *parameters))[:, 0])
+        aspirations = get_midpoints(statistics, resolution, threshold)
+        depth += 1
+    return dict(sorted(statistics.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Trains an aspiration grid refined around the SRE transitions")
+    parser.add_argument("habituation", type=float)
+    parser.add_argument("learning_rate", type=float)
+    parser.add_argument("nb_repetitions", type=int)
+    parser.add_argument("nb_episodes", type=int)
+    parser.add_argument("--games", nargs="+", default=["PD", "CH", "SG"])
+    parser.add_argument("--modes", nargs="+", default=["classic"])
+    parser.add_argument("--coarse-grid", nargs="+", type=float, default=None)
+    parser.add_argument("--resolution", type=float, default=RESOLUTION)
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    parser.add_argument("--sweep-size", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    for game_name in args.games:
+        for mode in args.modes:
+            statistics = refine(game_name, mode, args.habituation, args.learning_rate, args.nb_repetitions,
+                                args.nb_episodes, args.coarse_grid, args.resolution, args.threshold, args.sweep_size,
+                                args.seed)
+            print("Refined grid: game={0} mode={1} points={2}".format(game_name, mode, len(statistics)))
+            for aspiration, (sre, cooperation) in statistics.items():
+                print("A={0:<8} SRE={1:.3f} cooperation={2:.3f}".format(format_value(aspiration), sre, cooperation))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+import cProfile
+import functools
+import importlib
+import os
+import sys
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, NamedTuple, Optional, TextIO, Tuple
+
+# Methods timed by instrument, as (module, class, method). The timers are inclusive: compute_stimuli contains
+# get_supremum, and the get_* methods time the access to the recorded trajectories
+HOT_PATHS = [("model", "Bush_Mosteller", "query_next_actions"), ("matrix_payoffs", "Matrix_Payoffs", "get_payoff"),
+             ("model", "Bush_Mosteller", "compute_stimuli"), ("model", "Bush_Mosteller", "get_supremum"),
+             ("model", "Bush_Mosteller", "update_agent_aspirations"), ("agent", "Agent", "act"),
+             ("agent", "Agent", "learn"), ("model", "Bush_Mosteller", "get_aspirations"),
+             ("model", "Bush_Mosteller", "get_action_probabilities"), ("model", "Bush_Mosteller", "get_stimuli_agent"),
+             ("model", "Bush_Mosteller", "get_action"), ("batch_model", "Batch_Bush_Mosteller", "query_next_actions"),
+             ("batch_model", "Batch_Bush_Mosteller", "update"), ("batch_model", "Batch_Bush_Mosteller", "absorb"),
+             ("batch_model", "Batch_Bush_Mosteller", "fill"), ("random_streams", "Uniform_Stream", "draw_block"),
+             ("result_store", "Result_Store", "write"), ("result_store", "Result_Store", "write_part"),
+             ("result_store", "Result_Store", "merge_parts"), ("result_writer", "Result_Writer", "submit")]
+
+# Profilers of the current process, by worker name, so that the tasks run by a pool worker add up in one profile
+_profilers: Dict[str, cProfile.Profile] = dict()
+
+
+class Instrumentation(NamedTuple):
+    timers: bool = False
+    profile: Optional[str] = None
+
+
+class Phase_Timers:
+    def __init__(self):
+        """
+        Number of calls and total time spent in each phase of a training
+        """
+        self.calls: Dict[str, int] = dict()
+        self.seconds: Dict[str, float] = dict()
+
+    def add(self, phase: str, seconds: float, calls: int = 1) -> None:
+        self.calls[phase] = self.calls.get(phase, 0) + calls
+        self.seconds[phase] = self.seconds.get(phase, 0) + seconds
+
+    def merge(self, other: "Phase_Timers") -> None:
+        """
+        Adds the timers of another process to these ones
+        """
+        for phase in other.calls:
+            self.add(phase, other.seconds[phase], other.calls[phase])
+
+    def wrap(self, phase: str, function: Callable) -> Callable:
+        """
+        :return: The function, timed under the given phase
+        """
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(phase, time.perf_counter() - start)
+        return timed
+
+    def report(self) -> str:
+        """
+        :return: One line per phase, the slowest first
+        """
+        return "\n".join("{0:<45} {1:>10} calls {2:>10.3f}s {3:>10.2f}us/call".format(
+            phase, self.calls[phase], self.seconds[phase], self.seconds[phase] / self.calls[phase] * 1e6)
+            for phase in sorted(self.seconds, key=self.seconds.get, reverse=True))
+
+
+@contextmanager
+def instrument(timers: Phase_Timers, targets: List[Tuple[str, str, str]] = None):
+    """
+    Times the given methods while the context is active. The classes are patched, so nothing is added to the
+    simulation loop when no instrumentation is requested.
+    :param timers: The timers updated by the methods
+    :param targets: [optional] The methods, as (module, class, method). Default: HOT_PATHS
+    """
+    patched = []
+    try:
+        for module_name, class_name, method in targets or HOT_PATHS:
+            owner = getattr(importlib.import_module(module_name), class_name)
+            original = owner.__dict__[method]
+            setattr(owner, method, timers.wrap(class_name + "." + method, original))
+            patched.append((owner, method, original))
+        yield timers
+    finally:
+        for owner, method, original in reversed(patched):
+            setattr(owner, method, original)
+
+
+@contextmanager
+def worker(options: Optional[Instrumentation], name: str):
+    """
+    Instruments the work of a process as requested. With a profile folder, the cProfile statistics of the worker are
+    written to [folder]/[name]_[pid].prof, accumulated over all the calls made in the process.
+    :param options: [optional] The instrumentation requested. Default: None, no instrumentation
+    :param name: The name of the worker, e.g. the game it trains
+    :return: The timers of the work done in the context, None if they were not requested
+    """
+    if options is None:
+        yield None
+        return
+    timers = Phase_Timers() if options.timers else None
+    profiler = None
+    if options.profile is not None:
+        profiler = _profilers.setdefault(name, cProfile.Profile())
+        os.makedirs(options.profile, exist_ok=True)
+    try:
+        if profiler is not None:
+            profiler.enable()
+        if timers is not None:
+            with instrument(timers):
+                yield timers
+        else:
+            yield None
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(options.profile, "{0}_{1}.prof".format(name, os.getpid())))
+
+
+class Progress:
+    def __init__(self, total: float, unit: str = "episodes", stream: TextIO = sys.stdout):
+        """
+        Reports the progress of a worker, with its throughput and the time left.
+
+        :param total: The amount of work to do, e.g. the number of episodes times repetitions of every training
+        :param unit: The unit of the work. Default: "episodes"
+        :param stream: Where the progress is printed. Default: the standard output
+        """
+        self.total = total
+        self.unit = unit
+        self.stream = stream
+        self.done = 0
+        self.count = 0
+        self.start = time.perf_counter()
+
+    def update(self, work: float, message: str, nb_steps: Optional[int] = None) -> None:
+        """
+        :param work: The amount of work just done
+        :param message: Description of the work just done
+        :param nb_steps: [optional] Total number of steps, printed as (step/nb_steps). Default: None, no step count
+        """
+        self.done += work
+        self.count += 1
+        elapsed = time.perf_counter() - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0
+        remaining = (self.total - self.done) / rate if rate > 0 else 0
+        prefix = "" if nb_steps is None else "({0}/{1}) ".format(self.count, nb_steps)
+        print("{0}{1} [{2:.0f} {3}/s, ETA {4}]".format(prefix, message, rate, self.unit, format_duration(remaining)),
+              file=self.stream, flush=True)
+
+
+def format_duration(seconds: float) -> str:
+    """
+    :return: The duration as hours:minutes:seconds
+    """
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return "{0}:{1:02d}:{2:02d}".format(hours, minutes, seconds)
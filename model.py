@@ -1,23 +1,29 @@
 import math
-from typing import Tuple, List
+from typing import Tuple, List, Optional
 
 import numpy
 from numpy import ndarray
+from numpy.random import Generator
 
 from agent import Agent
 from matrix_payoffs import Matrix_Payoffs
+from random_streams import Uniform_Stream
+from training_result import ACTION_DTYPE, Training_Result
 
 
 class Bush_Mosteller:
-    def __init__(self, agents: List[Agent], game: Matrix_Payoffs):
+    def __init__(self, agents: List[Agent], game: Matrix_Payoffs, rng: Optional[Generator] = None):
         """
         :param agents: A list of agents
         :param game: The game to be played
+        :param rng: [optional] The random stream of the repetition. Default: the global numpy generator
         """
         self.agents = agents
+        self.uniforms = None if rng is None else Uniform_Stream([rng], len(agents))
         self.game = game
         self.payoffs = game.get_payoffs_vector()
-        self.action_probabilities, self.action, self.aspirations, self.stimuli = None, None, None, None
+        self.kernel = game.kernel
+        self.result = None
 
     def update_agent_aspirations(self, rewards: Tuple[int]) -> List[float]:
         """
@@ -38,17 +44,24 @@ class Bush_Mosteller:
         return [agent.cpt_stimuli(rewards[i], supremi[i]) for i, agent in enumerate(self.agents)]
 
     def get_supremum(self, aspi):
-        return math.ceil(max(abs(self.payoffs[0] - aspi), abs(self.payoffs[1] - aspi), abs(self.payoffs[2] - aspi),
-                             abs(self.payoffs[3] - aspi)))
+        """
+        :param aspi: The aspiration of an agent
+        :return: The denominator of the stimuli formula, max(|payoff - aspi|) being reached at the highest or at the
+        lowest payoff
+        """
+        return math.ceil(max(self.kernel.high - aspi, aspi - self.kernel.low))
 
     def query_next_actions(self) -> List[int]:
         """
         Queries all agents' next action
         :return: A list of actions where the ith element corresponds to action taken by agent i
         """
-        return [agent.act() for agent in self.agents]
+        if self.uniforms is None:
+            return [agent.act() for agent in self.agents]
+        uniforms = self.uniforms.next()[0]
+        return [agent.act(uniforms[i]) for i, agent in enumerate(self.agents)]
 
-    def run_episode(self) -> Tuple[ndarray, List[float], List[float]]:
+    def run_episode(self) -> Tuple[ndarray, List[float], List[float], ndarray]:
         """
         Runs a single episode of the game
         :return: A tuple containing: The actions taken by the agents,
@@ -60,39 +73,47 @@ class Bush_Mosteller:
         aspirations = self.update_agent_aspirations(payoffs)
 
         action_probabilities = numpy.zeros(len(self.agents), dtype=numpy.float64)
-        action = numpy.zeros(len(self.agents), dtype=numpy.float64)
+        action = numpy.zeros(len(self.agents), dtype=ACTION_DTYPE)
         for i, agent in enumerate(self.agents):
             action_probabilities[i] = agent.learn(stimuli[i], actions[i])
             action[i] = actions[i]
 
         return action_probabilities, stimuli, aspirations, action
 
-    def run(self, nb_runs: int) -> None:
-        self.aspirations = numpy.empty(nb_runs, dtype=object)
-        self.action_probabilities = numpy.empty(nb_runs, dtype=object)
-        self.stimuli = numpy.empty(nb_runs, dtype=object)
-        self.action = numpy.empty(nb_runs, dtype=object)
+    def run(self, nb_runs: int, out: Optional[Training_Result] = None) -> None:
+        """
+        Runs the given number of episodes
+        :param nb_runs: Number of episodes
+        :param out: [optional] Result of shape (agents, episodes) where the trajectories are written. Default: a new
+        result is allocated
+        """
+        self.result = Training_Result.allocate((len(self.agents), nb_runs)) if out is None else out
+        action_probabilities, aspirations, stimuli, action = self.result.as_tuple()
         for i in range(nb_runs):
-            self.action_probabilities[i], self.stimuli[i], self.aspirations[i], self.action[i] = self.run_episode()
+            action_probabilities[:, i], stimuli[:, i], aspirations[:, i], action[:, i] = self.run_episode()
 
-    def get_aspirations(self) -> Tuple[Tuple[float]]:
+    def get_aspirations(self) -> ndarray:
         """
-        :return: Tuple containing tuples where the ith tuple contains all the aspirations of agent i during training
+        :return: Array of shape (agents, episodes) where the ith row contains all the aspirations of agent i during
+        training
         """
-        return tuple(zip(*self.aspirations))
+        return self.result.aspirations
 
-    def get_action_probabilities(self) -> Tuple[Tuple[List[float]]]:
+    def get_action_probabilities(self) -> ndarray:
         """
-        :return: Tuple containing tuples of lists where the ith tuple contains all the action probabilities of agent
-        i during training as lists
+        :return: Array of shape (agents, episodes) where the ith row contains all the probabilities of cooperation of
+        agent i during training
         """
-        return tuple(zip(*self.action_probabilities))
+        return self.result.action_probabilities
 
-    def get_stimuli_agent(self) -> Tuple[Tuple[float]]:
+    def get_stimuli_agent(self) -> ndarray:
         """
-        :return: Tuple containing tuples where the ith tuple contains all the stimuli of agent i during training
+        :return: Array of shape (agents, episodes) where the ith row contains all the stimuli of agent i during training
         """
-        return tuple(zip(*self.stimuli))
+        return self.result.stimuli
 
-    def get_action(self) -> Tuple[Tuple[float]]:
-        return tuple(zip(*self.action))
+    def get_action(self) -> ndarray:
+        """
+        :return: Array of shape (agents, episodes) where the ith row contains all the actions of agent i during training
+        """
+        return self.result.actions
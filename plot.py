@@ -1,21 +1,48 @@
+import argparse
+import os
 import sys
 
 import matplotlib.pyplot as plt
 import numpy as np
 
-from runner import compute_propo_coop_mut, read_data
+from distribution_solver import Distribution_Solver
+from result_store import make_key
+from runner import get_game
+from summary_index import load_index
+
+PLOT_TYPES = ("cooperation", "sre", "fear_greed", "sre_exact")
 
 
 class Plot:
-    def __init__(self):
+    def __init__(self, output=None):
+        """
+        :param output: [optional] Folder where the figures are saved as PNG files, without any display. Default: None,
+        the figures are shown
+        """
         np.set_printoptions(threshold=sys.maxsize)  # allows to print the whole array in the terminal
         plt.rc("font", **{"size": 7})  # change the general font size
+        self.output = output
+        if output is not None:
+            plt.switch_backend("Agg")
+            os.makedirs(output, exist_ok=True)
 
-    def plot_cooperation(self, data, parameters_name):
+    def show(self, name):
+        """
+        Shows the current figure, or saves it as [output]/[name].png when exporting
+        """
+        if self.output is None:
+            plt.show()
+        else:
+            plt.savefig(os.path.join(self.output, name + ".png"), dpi=200)
+            print("Saved " + os.path.join(self.output, name + ".png"))
+        plt.close()
+
+    def plot_cooperation(self, data, parameters_name, name="cooperation"):
         """
         General function to plot our data.
 
         :param dta: The data to plot.
+        :param name: [optional] Name of the exported file. Default: "cooperation"
         """
         games = ["Prisoner's Dilemma", "Chicken", "Stag Hunt"]
         for game in range(len(data)):
@@ -27,17 +54,20 @@ class Plot:
             plt.xlabel("Iterations")
             plt.plot(data[game])
         plt.tight_layout()
-        plt.show()
+        self.show(name)
 
-    def plot_SRE_aspiration(self, coop_PD, coop_CH, coop_SG):
+    def plot_SRE_aspiration(self, coop_PD, coop_CH, coop_SG, aspirations=None, name="sre"):
         """
         Plot for the impact of the aspiration level on the SRE rate and
         a second plot with greed and fear.
 
         :param dta: The data to plot.
+        :param aspirations: [optional] The aspirations of PD, CH and SG, e.g. irregular grids. Default: 0 to 4 in
+        steps of 0.1 for every game
+        :param name: [optional] Name of the exported file. Default: "sre"
         """
         games = ["Prisoner's Dilemma", "Chicken", "Stag Hunt"]
-        x = np.linspace(0, 4, 41)
+        x_PD, x_CH, x_SG = aspirations or [np.linspace(0, 4, 41)] * 3
         for i in range(3):
             plt.subplot(3, 1, i + 1)
             plt.ylim(0, 1.1)
@@ -45,24 +75,28 @@ class Plot:
             plt.ylabel("%SRE")
             plt.xlabel("Aspiration")
             if i == 0:
-                plt.plot(x, coop_PD)
+                plt.plot(x_PD, coop_PD)
             elif i == 1:
-                plt.plot(x, coop_CH)
+                plt.plot(x_CH, coop_CH)
             else:
-                plt.plot(x, coop_SG)
+                plt.plot(x_SG, coop_SG)
         plt.tight_layout()
-        plt.show()
+        self.show(name)
 
     def plot_SRE_greed_fear(self, PD_classic, PD_fear, PD_greed, SG_classic, SG_fear, SG_greed, CH_classic, CH_fear,
-                             CH_greed):
+                             CH_greed, aspirations=None):
         """
         Plot for the impact of the aspiration level on the SRE rate and
         a second plot with greed and fear.
 
         :param dta: The data to plot.
+        :param aspirations: [optional] Dictionary mapping (game, mode) to the aspirations of the curve, e.g. irregular
+        grids. Default: 0 to 4 in steps of 0.1 for every curve
         """
         games = ["Prisoner's Dilemma", "Chicken", "Stag Hunt"]
-        x = np.linspace(0, 4, 41)
+        default = np.linspace(0, 4, 41)
+        x = {(game, mode): default for game in ["PD", "SG", "CH"] for mode in ["classic", "fear", "greed"]}
+        x.update(aspirations or {})
         for i in range(3):
             plt.subplot(3, 1, i + 1)
             plt.ylim(0, 1.1)
@@ -70,131 +104,125 @@ class Plot:
             plt.ylabel("%SRE")
             plt.xlabel("Aspiration")
             if i == 0:
-                plt.plot(x, PD_classic, label="classic", linestyle="dashed")
-                plt.plot(x, PD_fear, label="fear")
-                plt.plot(x, PD_greed, label="greed")
+                plt.plot(x["PD", "classic"], PD_classic, label="classic", linestyle="dashed")
+                plt.plot(x["PD", "fear"], PD_fear, label="fear")
+                plt.plot(x["PD", "greed"], PD_greed, label="greed")
                 plt.legend(["classic", "fear", "greed"])
             elif i == 1:
-                plt.plot(x, CH_classic, label="classic", linestyle="dashed")
-                plt.plot(x, CH_fear, label="fear")
-                plt.plot(x, CH_greed, label="greed")
+                plt.plot(x["CH", "classic"], CH_classic, label="classic", linestyle="dashed")
+                plt.plot(x["CH", "fear"], CH_fear, label="fear")
+                plt.plot(x["CH", "greed"], CH_greed, label="greed")
                 plt.legend(["classic", "fear", "greed"])
             else:
-                plt.plot(x, SG_classic, label="classic", linestyle="dashed")
-                plt.plot(x, SG_fear, label="fear")
-                plt.plot(x, SG_greed, label="greed")
+                plt.plot(x["SG", "classic"], SG_classic, label="classic", linestyle="dashed")
+                plt.plot(x["SG", "fear"], SG_fear, label="fear")
+                plt.plot(x["SG", "greed"], SG_greed, label="greed")
                 plt.legend(["classic", "fear", "greed"])
         plt.tight_layout()
-        plt.show()
-
-
-def main():
-    parameters_list = list()
-    if len(sys.argv) == 7:
-        for i in range(len(sys.argv[1:])):
-            sys.argv[i] = sys.argv[i].replace(".", "-")
-        parameters_list.append(sys.argv[1:])
-    elif len(sys.argv) == 3:
-        with open(sys.argv[1], "r") as parameters_file:
-            lines = parameters_file.readlines()
-        for line in lines:
-            line = line.replace(".", "-").strip("\n")
-            parameters_list.append(line.split(" "))
-    plot = Plot()
+        self.show("fear_greed")
+
+
+def main(parameters_list, output=None):
+    plot = Plot(output)
+    index = load_index()
     coop_by_game = []
     for parameters in parameters_list:
         for game_name in ["PD", "SG", "CH"]:
-            agt = read_data("data/agent_act_probs_{0}_{1}_{2}_{3}_{4}_{5}_{6}.p".format(game_name, *parameters))
-            coop_by_game.append(agt[10])
-            print(game_name + " convergence rate: " + str(compute_propo_coop_mut(agt)))
+            entry = index.get(make_key(game_name, *parameters))
+            coop_by_game.append(index.get_array(entry, "sample"))
+            print(game_name + " convergence rate: " + str(entry["sre"]))
         print("PD cooperation rate: ", sum(coop_by_game[0]) / len(coop_by_game[0]))
         print("SG cooperation rate: ", sum(coop_by_game[1]) / len(coop_by_game[1]))
         print("CH cooperation rate: ", sum(coop_by_game[2]) / len(coop_by_game[2]))
-        plot.plot_cooperation(coop_by_game, "Proba. of cooperation")
+        plot.plot_cooperation(coop_by_game, "Proba. of cooperation", "cooperation_" + "_".join(parameters))
         coop_by_game.clear()
 
 
-def mainSRE():
-    plot = Plot()
-    coop_PD = []
-    coop_SG = []
-    coop_CH = []
+def print_missing_curves(curves):
+    """
+    Reports the SRE curves without any training indexed, for h = 0, l = 0.5, 1000 repetitions and 250 episodes
+    :param curves: The (game, mode) of each empty curve
+    """
+    for game_name, mode in curves:
+        print("No training indexed for game={0} mode={1} h=0 l=0.5 reps=1000 eps=250, the figure is skipped".format(
+            game_name, mode), file=sys.stderr)
+
+
+def mainSRE(output=None):
+    """
+    Plots the SRE rate of every aspiration indexed, e.g. the fixed grid of parameters_source.txt or the irregular grid
+    of grid_refinement.py
+    """
+    plot = Plot(output)
+    index = load_index()
+    coop_by_game = dict()
+    aspirations_by_game = dict()
+    for game_name in ["PD", "SG", "CH"]:
+        aspirations_by_game[game_name], coop_by_game[game_name] = index.get_sre_curve(game_name, "classic", 0, 0.5,
+                                                                                       1000, 250)
+        for rate in coop_by_game[game_name]:
+            print(game_name + " convergence rate: " + str(rate))
+    if not all(coop_by_game.values()):
+        print_missing_curves([(game_name, "classic") for game_name in coop_by_game if not coop_by_game[game_name]])
+        return
+    plot.plot_SRE_aspiration(coop_by_game["PD"], coop_by_game["CH"], coop_by_game["SG"],
+                             [aspirations_by_game[game_name] for game_name in ["PD", "CH", "SG"]])
+
+
+def mainSREExact(output=None):
+    """
+    Same plot as mainSRE, computed without training by propagating the distribution of the probabilities of
+    cooperation
+    """
+    plot = Plot(output)
+    coop_by_game = {"PD": [], "SG": [], "CH": []}
     aspirations = [round(0.1 * i, 1) for i in range(41)]
-    for i in range(41):
+    for aspiration in aspirations:
         for game_name in ["PD", "SG", "CH"]:
-            if i % 10 == 0:
-                agt = read_data(
-                    "data/agent_act_probs_" + game_name + "_classic_0_" + str(int(aspirations[i])) + "_0-5_1000_250.p")
-            else:
-                aspirations[i] = str(aspirations[i]).replace(".", "-")
-                agt = read_data(
-                    "data/agent_act_probs_" + game_name + "_classic_0_" + str(aspirations[i]) + "_0-5_1000_250.p")
-            if game_name == "PD":
-                coop_PD.append(compute_propo_coop_mut(agt))
-            elif game_name == "SG":
-                coop_SG.append(compute_propo_coop_mut(agt))
-            else:
-                coop_CH.append(compute_propo_coop_mut(agt))
-            print(game_name + " convergence rate: " + str(compute_propo_coop_mut(agt)))
-    plot.plot_SRE_aspiration(coop_PD, coop_CH, coop_SG)
-    coop_CH.clear()
-    coop_SG.clear()
-    coop_PD.clear()
-
-
-def mainGreedFearSRE():
-    plot = Plot()
-    PD_classic = []
-    PD_fear = []
-    PD_greed = []
-    SG_classic = []
-    SG_fear = []
-    SG_greed = []
-    CH_classic = []
-    CH_fear = []
-    CH_greed = []
-    aspirations = [round(0.1 * i, 1) for i in range(41)]
-    for i in range(41):
-        for game_name in ["PD", "SG", "CH"]:
-            if i % 10 == 0:
-                agtClassic = read_data(
-                    "data/agent_act_probs_" + game_name + "_classic_0_" + str(int(aspirations[i])) + "_0-5_1000_250.p")
-                agtFear = read_data(
-                    "data/agent_act_probs_" + game_name + "_fear_0_" + str(int(aspirations[i])) + "_0-5_1000_250.p")
-                agtGreed = read_data(
-                    "data/agent_act_probs_" + game_name + "_greed_0_" + str(int(aspirations[i])) + "_0-5_1000_250.p")
-            else:
-                aspirations[i] = str(aspirations[i]).replace(".", "-")
-                agtClassic = read_data(
-                    "data/agent_act_probs_" + game_name + "_classic_0_" + str(aspirations[i]) + "_0-5_1000_250.p")
-                agtFear = read_data(
-                    "data/agent_act_probs_" + game_name + "_fear_0_" + str(aspirations[i]) + "_0-5_1000_250.p")
-                agtGreed = read_data(
-                    "data/agent_act_probs_" + game_name + "_greed_0_" + str(aspirations[i]) + "_0-5_1000_250.p")
-            if game_name == "PD":
-                PD_classic.append(compute_propo_coop_mut(agtClassic))
-                PD_fear.append(compute_propo_coop_mut(agtFear))
-                PD_greed.append(compute_propo_coop_mut(agtGreed))
-            elif game_name == "SG":
-                SG_classic.append(compute_propo_coop_mut(agtClassic))
-                SG_fear.append(compute_propo_coop_mut(agtFear))
-                SG_greed.append(compute_propo_coop_mut(agtGreed))
-            else:
-                CH_classic.append(compute_propo_coop_mut(agtClassic))
-                CH_fear.append(compute_propo_coop_mut(agtFear))
-                CH_greed.append(compute_propo_coop_mut(agtGreed))
-            print(game_name + " - classic - convergence rate: " + str(compute_propo_coop_mut(agtClassic)))
-            print(game_name + " - fear - convergence rate: " + str(compute_propo_coop_mut(agtFear)))
-            print(game_name + " - greed - convergence rate: " + str(compute_propo_coop_mut(agtGreed)))
-    plot.plot_SRE_greed_fear(PD_classic, PD_fear, PD_greed, SG_classic, SG_fear, SG_greed, CH_classic, CH_fear,
-                             CH_greed)
+            solver = Distribution_Solver(get_game(game_name, "classic"), aspiration, 0.5)
+            solver.run(250)
+            coop_by_game[game_name].append(solver.get_sre_rate())
+            print(game_name + " convergence rate: " + str(coop_by_game[game_name][-1]))
+    plot.plot_SRE_aspiration(coop_by_game["PD"], coop_by_game["CH"], coop_by_game["SG"], name="sre_exact")
+
+
+def mainGreedFearSRE(output=None):
+    """
+    Plots the SRE rate of every aspiration indexed for each game and mode, the grids of the modes being possibly
+    different when refined by grid_refinement.py
+    """
+    plot = Plot(output)
+    index = load_index()
+    sre = dict()
+    aspirations = dict()
+    for game_name in ["PD", "SG", "CH"]:
+        for mode in ["classic", "fear", "greed"]:
+            aspirations[game_name, mode], sre[game_name, mode] = index.get_sre_curve(game_name, mode, 0, 0.5, 1000,
+                                                                                     250)
+            for rate in sre[game_name, mode]:
+                print(game_name + " - " + mode + " - convergence rate: " + str(rate))
+    if not all(sre.values()):
+        print_missing_curves([game_mode for game_mode in sre if not sre[game_mode]])
+        return
+    plot.plot_SRE_greed_fear(*(sre[game_name, mode] for game_name in ["PD", "SG", "CH"]
+                               for mode in ["classic", "fear", "greed"]), aspirations)
 
 
 if __name__ == '__main__':
-    if len(sys.argv) == 3:
-        if sys.argv[2] == "cooperation":
-            main()
-        elif sys.argv[2] == "sre":
-            mainSRE()
-        elif sys.argv[2] == "fear_greed":
-            mainGreedFearSRE()
+    parser = argparse.ArgumentParser(description="Plots the trainings of the result store")
+    parser.add_argument("arguments", nargs="+")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+    plot_type = args.arguments.pop() if args.arguments[-1] in PLOT_TYPES else "cooperation"
+    if plot_type == "cooperation":
+        if len(args.arguments) == 6:
+            main([args.arguments], args.output)
+        else:
+            with open(args.arguments[0], "r") as parameters_file:
+                main([line.split() for line in parameters_file if line.strip()], args.output)
+    elif plot_type == "sre":
+        mainSRE(args.output)
+    elif plot_type == "fear_greed":
+        mainGreedFearSRE(args.output)
+    elif plot_type == "sre_exact":
+        mainSREExact(args.output)
@@ -0,0 +1,189 @@
+from typing import Optional, Sequence, Tuple, Union
+
+import numpy
+from numpy import ndarray
+from numpy.random import Generator
+
+from matrix_payoffs import Matrix_Payoffs
+from reducers import Reducer
+from training_result import ACTION_DTYPE, Training_Result
+
+
+def lattice_edges(width: int, height: int, periodic: bool = True) -> ndarray:
+    """
+    :param width: Number of columns of the lattice
+    :param height: Number of rows of the lattice
+    :param periodic: True to wrap the borders of the lattice (torus). Default: True
+    :return: The edges between the von Neumann neighbours of a lattice whose agent (x, y) has index y * width + x, as
+    an array of shape (edges, 2)
+    """
+    index = numpy.arange(width * height).reshape(height, width)
+    if periodic:
+        right, down = numpy.roll(index, -1, axis=1), numpy.roll(index, -1, axis=0)
+        edges = [(index, right), (index, down)]
+    else:
+        edges = [(index[:, :-1], index[:, 1:]), (index[:-1], index[1:])]
+    edges = numpy.concatenate([numpy.stack([a.ravel(), b.ravel()], axis=1) for a, b in edges])
+    # A periodic dimension of size 2 or less links the same pairs several times, or agents to themselves
+    edges = numpy.unique(numpy.sort(edges, axis=1), axis=0)
+    return edges[edges[:, 0] != edges[:, 1]]
+
+
+class Population_Bush_Mosteller:
+    def __init__(self, game: Matrix_Payoffs, nb_agents: int, learning_rate=0.5, aspiration=2, habituation=0,
+                 probab_init=0.5, edges: Optional[ndarray] = None, rng: Optional[Generator] = None):
+        """
+        Bush-Mosteller learners in a large population. The state of the agents is kept in arrays of shape (agents,),
+        and the parameters may be given per agent.
+
+        Without edges, the agents are paired at random at every episode; with an odd number of agents, one of them sits
+        out. With edges (e.g. lattice_edges), every agent plays its action against all its neighbours and learns from
+        the average of its payoffs; isolated agents never play.
+
+        :param game: The game to be played. Its payoffs are the ones of agent 0, i.e. the row player
+        :param nb_agents: Number of agents
+        :param learning_rate: l, or one value per agent
+        :param aspiration: A, or one value per agent
+        :param habituation: h, or one value per agent
+        :param probab_init: Initial probability of cooperation, or one value per agent
+        :param edges: [optional] The edges of the interaction graph, of shape (edges, 2). Default: random pairing
+        :param rng: [optional] The random stream of the population. Default: a new unseeded stream
+        """
+        self.game = game
+        self.nb_agents = nb_agents
+        self.kernel = game.kernel
+        # Payoff of an agent playing a against b at index a * 2 + b, i.e. [[R, S], [T, P]]
+        self.table = self.kernel.table[:, 0].copy()
+        self.leara, aspiration, self.habi, probab_init = [
+            numpy.broadcast_to(numpy.asarray(value, dtype=numpy.float64), (nb_agents,))
+            for value in (learning_rate, aspiration, habituation, probab_init)]
+        self.habituates = bool(numpy.any(self.habi != 0))
+        self.proba = probab_init.copy()
+        self.aspi = aspiration.copy()
+        self.supremum = self.get_supremum(self.aspi)
+        self.rng = numpy.random.default_rng() if rng is None else rng
+        self.uniforms = numpy.empty(nb_agents, dtype=numpy.float64)
+
+        self.edges = None if edges is None else numpy.asarray(edges, dtype=numpy.intp)
+        if self.edges is None:
+            self.players = slice(None) if nb_agents % 2 == 0 else None
+        else:
+            degree = numpy.bincount(self.edges.ravel(), minlength=nb_agents)
+            self.degree = degree.astype(numpy.float64)
+            self.players = slice(None) if numpy.all(degree) else numpy.flatnonzero(degree)
+        self.result = None
+
+    def get_supremum(self, aspi: ndarray) -> ndarray:
+        """
+        :param aspi: Array of aspirations
+        :return: The denominator of the stimuli formula for each aspiration
+        """
+        return self.kernel.get_supremum(aspi)
+
+    def query_next_actions(self) -> ndarray:
+        """
+        Draws the next action of every agent
+        :return: An array of shape (agents,) where 0 is cooperation and 1 is defection
+        """
+        self.rng.random(out=self.uniforms)
+        return (self.uniforms >= self.proba).astype(ACTION_DTYPE)
+
+    def match(self, actions: ndarray) -> Tuple[ndarray, Union[ndarray, slice]]:
+        """
+        Plays the game between the agents paired for the episode
+        :param actions: The actions of the agents, of shape (agents,)
+        :return: The payoff of every agent (0 for the agents that did not play) and the agents that played
+        """
+        payoffs = numpy.zeros(self.nb_agents, dtype=numpy.float64)
+        if self.edges is None:
+            order = self.rng.permutation(self.nb_agents)
+            players = self.players if self.players is not None else order[:-1]
+            first, second = order[0:self.nb_agents - 1:2], order[1::2]
+            payoffs[first] = self.table[actions[first] * 2 + actions[second]]
+            payoffs[second] = self.table[actions[second] * 2 + actions[first]]
+            return payoffs, players
+        first, second = actions[self.edges[:, 0]], actions[self.edges[:, 1]]
+        payoffs += numpy.bincount(self.edges[:, 0], weights=self.table[first * 2 + second], minlength=self.nb_agents)
+        payoffs += numpy.bincount(self.edges[:, 1], weights=self.table[second * 2 + first], minlength=self.nb_agents)
+        payoffs[self.players] /= self.degree[self.players]
+        return payoffs, self.players
+
+    def run_episode(self) -> Tuple[ndarray, ndarray, ndarray, ndarray]:
+        """
+        Runs a single episode of the game in the whole population. The update of Agent.learn is applied to the
+        probability of cooperation only: the probability of the chosen action moves towards 1 by (1 - p) * l * s for a
+        positive stimulus, and towards 0 by p * l * s for a negative one.
+        :return: A tuple containing: The probabilities of cooperation, the stimuli (0 for the agents that did not play),
+        the aspirations and the actions of the agents, each of shape (agents,)
+        """
+        actions = self.query_next_actions()
+        payoffs, players = self.match(actions)
+        stimuli = numpy.zeros(self.nb_agents, dtype=numpy.float64)
+        played, aspi = payoffs[players], self.aspi[players]
+        stimu = (played - aspi) / self.supremum[players]
+        stimuli[players] = stimu
+        if self.habituates:
+            habi = self.habi[players]
+            self.aspi[players] = (1 - habi) * aspi + habi * played
+            self.supremum[players] = self.get_supremum(self.aspi[players])
+
+        proba, cooperate = self.proba[players], actions[players] == 0
+        step = self.leara[players] * stimu
+        moved = numpy.where(cooperate == (stimu >= 0), 1 - proba, proba)
+        self.proba[players] = proba + numpy.where(cooperate, step, -step) * moved
+        return self.proba, stimuli, self.aspi, actions
+
+    def run(self, nb_runs: int, out: Optional[Training_Result] = None, reducers: Sequence[Reducer] = (),
+            record: bool = False) -> None:
+        """
+        Runs the given number of episodes
+        :param nb_runs: Number of episodes
+        :param out: [optional] Result of shape (agents, episodes) where the trajectories are written. Default: a new
+        result is allocated if record is True
+        :param reducers: [optional] Reducers updated with the data of every episode, the population being seen as a
+        single repetition of nb_agents agents
+        :param record: True to keep the trajectories of every agent. Default: False, as they quickly outgrow the memory
+        """
+        if record or out is not None:
+            self.result = Training_Result.allocate((self.nb_agents, nb_runs)) if out is None else out
+        for reducer in reducers:
+            reducer.start((), nb_runs)
+        for i in range(nb_runs):
+            proba, stimuli, aspi, actions = self.run_episode()
+            if self.result is not None:
+                self.result.action_probabilities[:, i], self.result.stimuli[:, i] = proba, stimuli
+                self.result.aspirations[:, i], self.result.actions[:, i] = aspi, actions
+            if reducers:
+                values = {"act_probs": proba[None], "asp": aspi[None], "stim": stimuli[None], "actions": actions[None]}
+                for reducer in reducers:
+                    reducer.update(i, values)
+
+    def get_cooperation_rate(self) -> float:
+        """
+        :return: The average probability of cooperation of the population
+        """
+        return float(self.proba.mean())
+
+    def get_aspirations(self) -> ndarray:
+        """
+        :return: Array of shape (agents, episodes) containing the aspirations during training
+        """
+        return self.result.aspirations
+
+    def get_action_probabilities(self) -> ndarray:
+        """
+        :return: Array of shape (agents, episodes) containing the probabilities of cooperation during training
+        """
+        return self.result.action_probabilities
+
+    def get_stimuli_agent(self) -> ndarray:
+        """
+        :return: Array of shape (agents, episodes) containing the stimuli during training
+        """
+        return self.result.stimuli
+
+    def get_action(self) -> ndarray:
+        """
+        :return: Array of shape (agents, episodes) containing the actions taken during training
+        """
+        return self.result.actions
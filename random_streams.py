@@ -0,0 +1,75 @@
+import json
+from typing import Dict, List, Optional, Union
+
+import numpy
+from numpy import ndarray
+from numpy.random import Generator
+
+# Number of episodes whose uniforms are drawn at once
+BLOCK_SIZE = 256
+
+
+def spawn_generators(seed: Optional[int], first_repetition: int, nb_repetitions: int) -> List[Generator]:
+    """
+    Creates one independent random stream per repetition. The stream of a repetition only depends on the seed and on
+    the index of the repetition, so a training gives the same results whether its repetitions are simulated together
+    or in chunks.
+    :param seed: The root seed. None to draw one from the operating system
+    :param first_repetition: Index of the first repetition
+    :param nb_repetitions: Number of repetitions
+    :return: The generators of the repetitions first_repetition to first_repetition + nb_repetitions - 1
+    """
+    if seed is None:
+        seed = numpy.random.SeedSequence().entropy
+    return [Generator(numpy.random.PCG64(numpy.random.SeedSequence(seed, spawn_key=(repetition,))))
+            for repetition in range(first_repetition, first_repetition + nb_repetitions)]
+
+
+class Uniform_Stream:
+    def __init__(self, generators: List[Generator], nb_agents: int, block_size: int = BLOCK_SIZE):
+        """
+        Serves the uniforms used to draw the actions of the agents, drawn from the stream of each repetition by
+        blocks of episodes.
+
+        :param generators: One generator per repetition
+        :param nb_agents: Number of agents per repetition
+        :param block_size: Number of episodes drawn at once
+        """
+        self.generators = generators
+        self.block = numpy.empty((len(generators), block_size, nb_agents), dtype=numpy.float64)
+        self.position = block_size
+        # Mask of the repetitions whose uniforms are still used, None for all of them
+        self.active = None
+
+    def get_state(self) -> Dict[str, Union[ndarray, str]]:
+        """
+        :return: The states of the generators, as JSON, the uniforms of the current block not served yet and the
+        position in the block
+        """
+        return {"generators": json.dumps([generator.bit_generator.state for generator in self.generators]),
+                "block": self.block[:, self.position:], "position": numpy.int64(self.position)}
+
+    def set_state(self, state: Dict[str, Union[ndarray, str]]) -> None:
+        """
+        Restores a state returned by get_state, the streams continuing from the same uniform
+        :param state: The state of the streams
+        """
+        for generator, generator_state in zip(self.generators, json.loads(str(state["generators"]))):
+            generator.bit_generator.state = generator_state
+        self.position = int(state["position"])
+        self.block[:, self.position:] = state["block"]
+
+    def draw_block(self) -> None:
+        for repetition, generator in enumerate(self.generators):
+            if self.active is None or self.active[repetition]:
+                generator.random(out=self.block[repetition])
+        self.position = 0
+
+    def next(self) -> ndarray:
+        """
+        :return: The uniforms of the next episode, of shape (repetitions, agents)
+        """
+        if self.position == self.block.shape[1]:
+            self.draw_block()
+        self.position += 1
+        return self.block[:, self.position - 1]
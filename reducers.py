@@ -0,0 +1,147 @@
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy
+from numpy import ndarray
+
+
+class Reducer:
+    def __init__(self, data_type: str = "act_probs", agent: Optional[int] = None):
+        """
+        Summary of a training updated online at every episode, so that the trajectories never have to be kept.
+
+        :param data_type: The data reduced: "act_probs", "asp", "stim" or "actions". Default: "act_probs"
+        :param agent: The index of the agent whose data is reduced. Default: None, all the agents
+        """
+        self.data_type = data_type
+        self.agent = agent
+        self.batch_shape, self.nb_episodes = None, None
+
+    def start(self, batch_shape: Tuple[int, ...], nb_episodes: int) -> None:
+        """
+        Called before each run of a model. The first call allocates the summary, the next ones (e.g. the following
+        chunks of repetitions) keep accumulating into it.
+        :param batch_shape: The shape of the parameter set axes of the model, () for a single parameter set
+        :param nb_episodes: Number of episodes of the run
+        """
+        if self.nb_episodes is None:
+            self.batch_shape, self.nb_episodes = batch_shape, nb_episodes
+            self.allocate()
+
+    def allocate(self) -> None:
+        pass
+
+    def select(self, values: Dict[str, ndarray]) -> ndarray:
+        """
+        :param values: The data of an episode, each array being of shape (..., repetitions, agents)
+        :return: The reduced data, of shape (..., samples)
+        """
+        data = values[self.data_type]
+        if self.agent is not None:
+            data = data[..., self.agent:self.agent + 1]
+        return data.reshape(data.shape[:-2] + (-1,))
+
+    def update(self, episode: int, values: Dict[str, ndarray]) -> None:
+        """
+        :param episode: Index of the episode
+        :param values: The data of the episode, each array being of shape (..., repetitions, agents)
+        """
+        raise NotImplementedError
+
+
+class Running_Moments(Reducer):
+    def allocate(self) -> None:
+        self.count = numpy.zeros(self.nb_episodes, dtype=numpy.int64)
+        self.mean = numpy.zeros(self.batch_shape + (self.nb_episodes,), dtype=numpy.float64)
+        self.m2 = numpy.zeros(self.batch_shape + (self.nb_episodes,), dtype=numpy.float64)
+
+    def update(self, episode: int, values: Dict[str, ndarray]) -> None:
+        """
+        Merges the mean and the sum of squared deviations of the episode with the ones accumulated so far
+        """
+        data = self.select(values)
+        count_a, count_b = self.count[episode], data.shape[-1]
+        mean_b = data.mean(axis=-1)
+        m2_b = numpy.square(data - mean_b[..., numpy.newaxis]).sum(axis=-1)
+        delta = mean_b - self.mean[..., episode]
+        count = count_a + count_b
+        self.mean[..., episode] += delta * count_b / count
+        self.m2[..., episode] += m2_b + delta ** 2 * count_a * count_b / count
+        self.count[episode] = count
+
+    def get_mean(self) -> ndarray:
+        """
+        :return: The mean at each episode, of shape (..., episodes)
+        """
+        return self.mean
+
+    def get_variance(self) -> ndarray:
+        """
+        :return: The variance at each episode, of shape (..., episodes)
+        """
+        return self.m2 / numpy.maximum(self.count, 1)
+
+
+class Convergence_Counter(Reducer):
+    def __init__(self, checkpoints: Optional[Sequence[int]] = None, threshold: float = 0.9, agent: Optional[int] = 0):
+        """
+        Counts the repetitions whose probability of cooperation exceeds a threshold at chosen episodes, i.e. the
+        repetitions that reached the self-reinforcing mutual cooperation.
+
+        :param checkpoints: The indices of the episodes. Default: the episode used by runner.compute_propo_coop_mut
+        :param threshold: The probability of cooperation above which a repetition is counted. Default: 0.9
+        :param agent: The index of the agent. Default: 0, as in runner.compute_propo_coop_mut
+        """
+        super().__init__("act_probs", agent)
+        self.checkpoints = checkpoints
+        self.threshold = threshold
+
+    def allocate(self) -> None:
+        if self.checkpoints is None:
+            self.checkpoints = [99 if self.nb_episodes < 500 else 499]
+        self.counts = numpy.zeros(self.batch_shape + (len(self.checkpoints),), dtype=numpy.int64)
+        self.totals = numpy.zeros(len(self.checkpoints), dtype=numpy.int64)
+
+    def update(self, episode: int, values: Dict[str, ndarray]) -> None:
+        if episode not in self.checkpoints:
+            return
+        data = self.select(values)
+        index = list(self.checkpoints).index(episode)
+        self.counts[..., index] += numpy.count_nonzero(data > self.threshold, axis=-1)
+        self.totals[index] += data.shape[-1]
+
+    def get_rates(self) -> ndarray:
+        """
+        :return: The proportion of repetitions above the threshold at each checkpoint, of shape (..., checkpoints)
+        """
+        return self.counts / numpy.maximum(self.totals, 1)
+
+
+class Final_Histogram(Reducer):
+    def __init__(self, bins: int = 20, value_range: Tuple[float, float] = (0, 1), data_type: str = "act_probs",
+                 agent: Optional[int] = None):
+        """
+        Histogram of the values reached at the last episode.
+
+        :param bins: Number of bins of equal width. Default: 20
+        :param value_range: The lower and upper edges of the bins, values outside are counted in the extreme bins.
+        Default: (0, 1)
+        :param data_type: The data reduced. Default: "act_probs"
+        :param agent: The index of the agent. Default: None, all the agents
+        """
+        super().__init__(data_type, agent)
+        self.bins = bins
+        self.edges = numpy.linspace(value_range[0], value_range[1], bins + 1)
+
+    def allocate(self) -> None:
+        self.counts = numpy.zeros(self.batch_shape + (self.bins,), dtype=numpy.int64)
+
+    def update(self, episode: int, values: Dict[str, ndarray]) -> None:
+        if episode != self.nb_episodes - 1:
+            return
+        data = self.select(values)
+        width = self.edges[-1] - self.edges[0]
+        index = numpy.clip(((data - self.edges[0]) / width * self.bins).astype(numpy.int64), 0, self.bins - 1)
+        nb_batches = int(numpy.prod(self.batch_shape, dtype=numpy.int64))
+        offsets = numpy.arange(nb_batches).reshape(self.batch_shape + (1,)) * self.bins
+        counts = numpy.bincount((index + offsets).ravel(), minlength=nb_batches * self.bins)
+        self.counts += counts.reshape(self.batch_shape + (self.bins,))
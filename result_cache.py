@@ -0,0 +1,169 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import numpy
+from numpy.lib.format import open_memmap
+
+from result_store import DATA_TYPES, Result_Store, format_value
+from training_result import ACTION_DTYPE, Training_Result
+
+
+def cache_key(payoffs: List[float], habituation: float, aspiration: float, learning_rate: float, nb_episodes: int,
+              seed: int, engine_version: int) -> str:
+    """
+    Hashes everything that determines the trajectories of a training except the number of repetitions, so that a
+    training can be extended with more repetitions under the same key
+    :return: The hexadecimal digest identifying the training
+    """
+    content = {"payoffs": [format_value(payoff) for payoff in payoffs], "habituation": format_value(habituation),
+               "aspiration": format_value(aspiration), "learning_rate": format_value(learning_rate),
+               "nb_episodes": int(nb_episodes), "seed": int(seed), "engine_version": int(engine_version)}
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+class Result_Cache:
+    def __init__(self, root: str = "data/cache/", max_bytes: Optional[int] = None):
+        """
+        Content-addressed cache of training results. Every entry is stored under the key returned by cache_key in
+        (repetitions, agents, episodes) order, so that the first repetitions of an entry can be served for any
+        smaller request and new repetitions can be appended to it. The least recently used entries are evicted once
+        the cache exceeds its size limit.
+
+        :param root: The folder of the cache
+        :param max_bytes: [optional] The size limit of the cache. Default: unlimited
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(root, "index.json")
+        os.makedirs(root, exist_ok=True)
+
+    @contextmanager
+    def lock(self):
+        """
+        Holds an exclusive lock on the cache, shared by every process using it
+        """
+        with open(os.path.join(self.root, "index.lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def load_index(self) -> Dict[str, Dict]:
+        """
+        :return: The index, mapping each key to its number of repetitions, size in bytes and last access time
+        """
+        if not os.path.exists(self.index_path):
+            return dict()
+        with open(self.index_path, "r") as source:
+            return json.load(source)
+
+    def save_index(self, index: Dict[str, Dict]) -> None:
+        temporary = self.index_path + ".tmp"
+        with open(temporary, "w") as dest:
+            json.dump(index, dest, indent=1, sort_keys=True)
+        os.replace(temporary, self.index_path)
+
+    def get_path(self, key: str, data_type: str) -> str:
+        return os.path.join(self.root, key, data_type + ".npy")
+
+    def stored_repetitions(self, key: str) -> int:
+        """
+        :param key: The key of the training
+        :return: The number of repetitions stored for the training, 0 if there are none
+        """
+        return self.load_index().get(key, {}).get("nb_repetitions", 0)
+
+    def read(self, key: str, nb_repetitions: int) -> Optional[Training_Result]:
+        """
+        :param key: The key of the training
+        :param nb_repetitions: Number of repetitions requested
+        :return: Read-only memory-mapped views on the first nb_repetitions repetitions, None if fewer are stored
+        """
+        with self.lock():
+            index = self.load_index()
+            if index.get(key, {}).get("nb_repetitions", 0) < nb_repetitions:
+                return None
+            index[key]["last_access"] = time.time()
+            self.save_index(index)
+        return Training_Result(*(numpy.load(self.get_path(key, data_type), mmap_mode="r")[:nb_repetitions]
+                                 for data_type in DATA_TYPES))
+
+    def append(self, key: str, first_repetition: int, result: Training_Result) -> bool:
+        """
+        Adds repetitions after the ones already stored for the training. The repetitions that are already stored are
+        skipped.
+        :param key: The key of the training
+        :param first_repetition: Index of the first repetition of the result
+        :param result: The repetitions, of shape (repetitions, agents, episodes)
+        :return: False if the repetitions before first_repetition are missing, e.g. because the entry was evicted by
+        another process in the meantime, the result being then dropped
+        """
+        with self.lock():
+            stored = self.load_index().get(key, {}).get("nb_repetitions", 0)
+            if first_repetition > stored:
+                return False
+            result = result[stored - first_repetition:]
+            if result.nb_repetitions == 0:
+                return True
+            shape = (stored + result.nb_repetitions, result.nb_agents, result.nb_episodes)
+            os.makedirs(os.path.join(self.root, key), exist_ok=True)
+            for data_type, data in zip(DATA_TYPES, result.as_tuple()):
+                path = self.get_path(key, data_type)
+                dest = open_memmap(path + ".tmp", mode="w+", shape=shape,
+                                   dtype=ACTION_DTYPE if data_type == "actions" else numpy.float64)
+                if stored:
+                    dest[:stored] = numpy.load(path, mmap_mode="r")
+                dest[stored:] = data
+                dest.flush()
+                del dest
+                os.replace(path + ".tmp", path)
+            index = self.load_index()
+            index[key] = {"nb_repetitions": shape[0], "last_access": time.time(),
+                          "bytes": sum(os.path.getsize(self.get_path(key, data_type)) for data_type in DATA_TYPES)}
+            self.evict(index, keep=key)
+            self.save_index(index)
+        return True
+
+    def evict(self, index: Dict[str, Dict], keep: Optional[str] = None) -> None:
+        """
+        Removes the least recently used entries until the cache fits in its size limit
+        :param index: The index, updated in place
+        :param keep: [optional] A key that is never evicted, e.g. the entry being written
+        """
+        if self.max_bytes is None:
+            return
+        total = sum(entry["bytes"] for entry in index.values())
+        for key in sorted(index, key=lambda k: index[k]["last_access"]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= index.pop(key)["bytes"]
+            shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+
+
+def serve(cache: Result_Cache, store: Result_Store, store_key: Dict, key: str) -> bool:
+    """
+    Saves a training in the result store from the cache, if the cache holds enough repetitions
+    :param cache: The cache
+    :param store: The result store
+    :param store_key: The key of the training in the store, as returned by result_store.make_key
+    :param key: The key of the training in the cache
+    :return: True if the store holds the training, either because it was already saved or because it was served
+    from the cache
+    """
+    entry = store.get_entry(store_key)
+    if entry is not None and entry.get("cache_key") == key:
+        return True
+    result = cache.read(key, store_key["nb_repetitions"])
+    if result is None:
+        return False
+    store.write(store_key, result, cache_key=key)
+    return True
@@ -0,0 +1,240 @@
+import fcntl
+import json
+import os
+import shutil
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+import numpy
+from numpy import ndarray
+from numpy.lib.format import open_memmap
+
+from training_result import ACTION_DTYPE, Training_Result
+
+# Data types saved for every training, in the order of the arrays of Training_Result
+DATA_TYPES = ("act_probs", "asp", "stim", "actions")
+KEY_FIELDS = ("game", "mode", "habituation", "aspiration", "learning_rate", "nb_repetitions", "nb_episodes")
+
+
+def format_value(value) -> str:
+    """
+    :param value: A parameter value
+    :return: The shortest string representing the value, so that 1, 1.0 and "1" give the same key
+    """
+    if isinstance(value, str):
+        value = float(value)
+    if isinstance(value, (int, numpy.integer)):
+        return str(value)
+    return numpy.format_float_positional(float(value), trim="-")
+
+
+def make_key(game: str, mode: str, habituation, aspiration, learning_rate, nb_repetitions, nb_episodes) -> Dict:
+    """
+    :return: The key identifying a training in the store
+    """
+    return {"game": game, "mode": mode.strip(), "habituation": float(habituation), "aspiration": float(aspiration),
+            "learning_rate": float(learning_rate), "nb_repetitions": int(nb_repetitions),
+            "nb_episodes": int(nb_episodes)}
+
+
+def entry_name(key: Dict) -> str:
+    """
+    :param key: A key returned by make_key
+    :return: The name of the entry, following the filename format of the data folder
+    """
+    values = [key["game"], key["mode"]] + [format_value(key[field]) for field in KEY_FIELDS[2:]]
+    return "_".join(values).replace(".", "-")
+
+
+class Result_Store:
+    def __init__(self, root: str = "data/"):
+        """
+        Columnar store of training results. Every data type of a training is saved in its own .npy file in
+        (episodes, agents, repetitions) order, so that reading one episode across all the repetitions only touches
+        the pages holding that episode. A manifest maps the key of each training to its files.
+
+        :param root: The folder of the store
+        """
+        self.root = root
+        self.manifest_path = os.path.join(root, "manifest.json")
+        os.makedirs(root, exist_ok=True)
+
+    @contextmanager
+    def lock(self):
+        """
+        Holds an exclusive lock on the manifest, shared by every process using the store
+        """
+        with open(os.path.join(self.root, "manifest.lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def load_manifest(self) -> Dict[str, Dict]:
+        """
+        :return: The manifest, mapping the name of each entry to its key and files
+        """
+        if not os.path.exists(self.manifest_path):
+            return dict()
+        with open(self.manifest_path, "r") as source:
+            return json.load(source)
+
+    def save_manifest(self, manifest: Dict[str, Dict]) -> None:
+        temporary = self.manifest_path + ".tmp"
+        with open(temporary, "w") as dest:
+            json.dump(manifest, dest, indent=1, sort_keys=True)
+        os.replace(temporary, self.manifest_path)
+
+    def get_path(self, key: Dict, data_type: str) -> str:
+        return os.path.join(self.root, entry_name(key), data_type + ".npy")
+
+    def allocate(self, key: Dict, nb_agents: int, nb_repetitions: Optional[int] = None,
+                 reopen: bool = False) -> Training_Result:
+        """
+        Creates the temporary files of an entry, renamed to the files of the entry by publish, so that a training
+        interrupted while being written never replaces complete files
+        :param key: The key of the training
+        :param nb_agents: Number of agents
+        :param nb_repetitions: [optional] Number of repetitions stored, e.g. the ones reached by an adaptive training.
+        Default: the one of the key
+        :param reopen: True to open the temporary files created before, e.g. by an interrupted training, without
+        erasing them. Default: False
+        :return: A result made of writable views on the files, of shape (repetitions, agents, episodes)
+        """
+        os.makedirs(os.path.join(self.root, entry_name(key)), exist_ok=True)
+        if nb_repetitions is None:
+            nb_repetitions = key["nb_repetitions"]
+        shape = (key["nb_episodes"], nb_agents, nb_repetitions)
+        mode = "r+" if reopen else "w+"
+        return Training_Result(*(open_memmap(self.get_path(key, data_type) + ".tmp", mode=mode, shape=shape,
+                                             dtype=ACTION_DTYPE if data_type == "actions" else numpy.float64)
+                                 .transpose(2, 1, 0) for data_type in DATA_TYPES))
+
+    def publish(self, key: Dict) -> None:
+        """
+        Renames the temporary files created by allocate, once written and flushed, to the files of the entry
+        :param key: The key of the training
+        """
+        for data_type in DATA_TYPES:
+            path = self.get_path(key, data_type)
+            os.replace(path + ".tmp", path)
+
+    def register(self, key: Dict, nb_agents: int, **metadata) -> None:
+        """
+        Adds an entry whose files have been written to the manifest
+        :param key: The key of the training
+        :param nb_agents: Number of agents
+        :param metadata: [optional] Additional fields of the entry
+        """
+        entry = dict(key, **metadata)
+        entry["nb_agents"] = nb_agents
+        entry["files"] = {data_type: os.path.join(entry_name(key), data_type + ".npy") for data_type in DATA_TYPES}
+        with self.lock():
+            manifest = self.load_manifest()
+            manifest[entry_name(key)] = entry
+            self.save_manifest(manifest)
+
+    def write(self, key: Dict, result: Training_Result, **metadata) -> None:
+        """
+        Saves a training result, of shape (repetitions, agents, episodes), and registers it in the manifest. The
+        result may hold fewer repetitions than the key, e.g. when an adaptive training stopped before its cap
+        :param key: The key of the training
+        :param result: The result
+        :param metadata: [optional] Additional fields of the entry
+        """
+        views = self.allocate(key, result.nb_agents, result.nb_repetitions)
+        for source, dest in zip(result.as_tuple(), views.as_tuple()):
+            dest[...] = source
+            dest.flush()
+        del views
+        self.publish(key)
+        self.register(key, result.nb_agents, **metadata)
+
+    def get_parts_folder(self, key: Dict) -> str:
+        return os.path.join(self.root, entry_name(key), "parts")
+
+    def write_part(self, key: Dict, start: int, result: Training_Result) -> None:
+        """
+        Saves the result of a chunk of repetitions of a training, to be merged later by merge_parts
+        :param key: The key of the whole training
+        :param start: Index of the first repetition of the chunk
+        :param result: The result of the chunk, of shape (repetitions, agents, episodes)
+        """
+        folder = self.get_parts_folder(key)
+        os.makedirs(folder, exist_ok=True)
+        for data_type, data in zip(DATA_TYPES, result.as_tuple()):
+            path = os.path.join(folder, f"{start}_{result.nb_repetitions}_{data_type}.npy")
+            with open(path + ".tmp", "wb") as dest:
+                numpy.save(dest, data)
+            os.replace(path + ".tmp", path)
+
+    def list_parts(self, key: Dict) -> List[Tuple[int, int]]:
+        """
+        :param key: The key of the whole training
+        :return: The (start, number of repetitions) of every chunk saved by write_part
+        """
+        folder = self.get_parts_folder(key)
+        if not os.path.exists(folder):
+            return []
+        parts = [name.split("_")[:2] for name in os.listdir(folder) if name.endswith(f"_{DATA_TYPES[-1]}.npy")]
+        return sorted((int(start), int(nb_repetitions)) for start, nb_repetitions in parts)
+
+    def read_parts(self, key: Dict) -> List[Tuple[int, Training_Result]]:
+        """
+        :param key: The key of the whole training
+        :return: The index of the first repetition and the memory-mapped result of every chunk saved by write_part
+        """
+        folder = self.get_parts_folder(key)
+        return [(start, Training_Result(*(numpy.load(os.path.join(folder, f"{start}_{nb_repetitions}_{data_type}.npy"),
+                                                      mmap_mode="r") for data_type in DATA_TYPES)))
+                for start, nb_repetitions in self.list_parts(key)]
+
+    def remove_parts(self, key: Dict) -> None:
+        shutil.rmtree(self.get_parts_folder(key), ignore_errors=True)
+
+    def merge_parts(self, key: Dict, **metadata) -> None:
+        """
+        Merges the chunks saved by write_part into the files of the training and registers it in the manifest
+        :param key: The key of the whole training
+        :param metadata: [optional] Additional fields of the entry
+        """
+        parts = self.read_parts(key)
+        views = self.allocate(key, parts[0][1].nb_agents)
+        for start, part in parts:
+            for source, dest in zip(part.as_tuple(), views.as_tuple()):
+                dest[start:start + part.nb_repetitions] = source
+        for dest in views.as_tuple():
+            dest.flush()
+        del views
+        self.publish(key)
+        self.register(key, parts[0][1].nb_agents, **metadata)
+        self.remove_parts(key)
+
+    def contains(self, key: Dict) -> bool:
+        return entry_name(key) in self.load_manifest()
+
+    def get_entry(self, key: Dict) -> Optional[Dict]:
+        """
+        :param key: The key of the training
+        :return: The manifest entry of the training, None if it is not stored
+        """
+        return self.load_manifest().get(entry_name(key))
+
+    def read(self, key: Dict, data_type: str = "act_probs") -> ndarray:
+        """
+        :param key: The key of the training
+        :param data_type: "act_probs", "asp", "stim" or "actions"
+        :return: A read-only memory-mapped view of shape (repetitions, agents, episodes)
+        """
+        entry = self.load_manifest().get(entry_name(key))
+        if entry is None:
+            raise KeyError(f"No training stored for {entry_name(key)}")
+        return numpy.load(os.path.join(self.root, entry["files"][data_type]), mmap_mode="r").transpose(2, 1, 0)
+
+    def read_result(self, key: Dict) -> Training_Result:
+        """
+        :param key: The key of the training
+        :return: A result made of read-only memory-mapped views
+        """
+        return Training_Result(*(self.read(key, data_type) for data_type in DATA_TYPES))
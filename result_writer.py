@@ -0,0 +1,104 @@
+import threading
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from result_store import Result_Store
+from training_result import Training_Result
+
+# Bytes of results held in flight by a writer before the training waits for them to be written (1 GiB)
+WRITER_MEMORY_LIMIT = 1 << 30
+
+
+class Result_Writer:
+    def __init__(self, max_bytes: int = WRITER_MEMORY_LIMIT, root: str = "data/"):
+        """
+        Writes training results to the result store in a background thread, so that the next parameter set trains
+        while the previous results are copied to disk. The results submitted are held in a queue until written; when
+        they exceed max_bytes, submit waits for the writer to catch up. A result larger than the limit is accepted
+        when nothing else is in flight, so that it cannot wait forever.
+
+        :param max_bytes: Bytes of results held in flight at most. Default: WRITER_MEMORY_LIMIT
+        :param root: The folder of the store. Default: "data/"
+        """
+        self.store = Result_Store(root)
+        self.max_bytes = max_bytes
+        self.pending: Deque[Tuple[Dict, Training_Result, Dict, int]] = deque()
+        self.in_flight = 0
+        self.closed = False
+        self.error: Optional[BaseException] = None
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name="result-writer", daemon=True)
+        self.thread.start()
+
+    def __enter__(self) -> "Result_Writer":
+        return self
+
+    def __exit__(self, *exception) -> None:
+        self.close()
+
+    def submit(self, key: Dict, result: Training_Result, **metadata) -> None:
+        """
+        Queues a result to be written by Result_Store.write. The result must not be modified afterwards
+        :param key: The key of the training
+        :param result: The result, of shape (repetitions, agents, episodes)
+        :param metadata: [optional] Additional fields of the entry
+        """
+        nbytes = result.nbytes
+        with self.condition:
+            self.condition.wait_for(lambda: self.error is not None or self.in_flight == 0
+                                    or self.in_flight + nbytes <= self.max_bytes)
+            self.raise_error()
+            if self.closed:
+                raise ValueError("Result_Writer is closed")
+            self.pending.append((key, result, metadata, nbytes))
+            self.in_flight += nbytes
+            self.condition.notify_all()
+
+    def run(self) -> None:
+        """
+        Loop of the writer thread, writing the results in the order they were submitted
+        """
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending or self.closed)
+                if not self.pending:
+                    return
+                key, result, metadata, nbytes = self.pending[0]
+            try:
+                self.store.write(key, result, **metadata)
+            except BaseException as error:
+                with self.condition:
+                    self.error = error
+                    self.pending.clear()
+                    self.in_flight = 0
+                    self.condition.notify_all()
+                return
+            with self.condition:
+                self.pending.popleft()
+                self.in_flight -= nbytes
+                self.condition.notify_all()
+
+    def flush(self) -> None:
+        """
+        Waits until every result submitted has been written
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: not self.pending or self.error is not None)
+        self.raise_error()
+
+    def close(self) -> None:
+        """
+        Writes the remaining results and stops the writer thread
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+        self.raise_error()
+
+    def raise_error(self) -> None:
+        """
+        Raises the error that stopped the writer thread, if any
+        """
+        if self.error is not None:
+            raise RuntimeError("Result_Writer failed to write a result") from self.error
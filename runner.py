@@ -1,90 +1,146 @@
+import argparse
+import itertools
+import math
 import os
-import pickle
-import sys
 from multiprocessing import Process
-from typing import Tuple, List
+from statistics import NormalDist
+from typing import Dict, Tuple, List, Sequence, Optional, Union
 
 import numpy
 from numpy import ndarray
 
-from agent import Agent
+from agent import Agent, Agent_Type
+from batch_model import Batch_Bush_Mosteller
+from checkpoint import CHECKPOINT_INTERVAL, Checkpoint, Sweep_Journal
+from game_kernel import apply_mode
+from instrumentation import Instrumentation, Progress, worker
 from matrix_payoffs import Matrix_Payoffs
 from model import Bush_Mosteller
+from population import Population_Bush_Mosteller
+from random_streams import spawn_generators
+from reducers import Reducer
+from result_cache import Result_Cache, cache_key, serve
+from result_store import Result_Store, entry_name, make_key
+from result_writer import WRITER_MEMORY_LIMIT, Result_Writer
+from scheduler import schedule
+from training_result import Training_Result
 
+ENGINES = ("classic", "batch", "sweep")
+# Version of the simulation, to be increased whenever a change alters the trajectories of a seeded training
+ENGINE_VERSION = 1
+# Number of repetitions simulated at once by train_streaming
+STREAMING_CHUNK_SIZE = 10000
+# Number of repetitions trained between two checks of the confidence interval by train_adaptive
+ADAPTIVE_BATCH_SIZE = 100
 
-def get_payoffs_vector(game: str = "PD", fear=False, greed=False) -> List[int]:
+
+def get_payoffs_vector(game: str = "PD") -> List[int]:
     """
-    Returns the payoff vector for one of three games: Prisoner's Dilemma, Stag Hunt, Chicken
-    [optional] Apply fear or greed modifiers
-    :param game: string: "PD"=Prisoner's Dilemma, "SH"=Stag Hunt, "CH"=Chicken. Default: "PD"
-    :param fear: True to apply a fear modifier. Default: False
-    :param greed: True to apply a greed modifier. Default: False
+    Returns the payoff vector for one of three games: Prisoner's Dilemma, Stag Hunt, Chicken. The modes are applied
+    by game_kernel.apply_mode
+    :param game: string: "PD"=Prisoner's Dilemma, "SG"=Stag Hunt, "CH"=Chicken. Default: "PD"
     :return: The payoff vector
     """
-    temptation = 0
-    reward = 1
-    punishment = 2
-    sucker = 3
     pd = [4, 3, 1, 0]  # Prisoner's Dilemma: T > R > P > S
 
     if game == "SG":
         pd = [3, 4, 1, 0]  # Stag Hunt: R > T > P > S
     elif game == "CH":
         pd = [4, 3, 0, 1]  # Chicken: T > R > S > P
-    if fear:
-        pd[sucker] = -1
-    elif greed:
-        pd[temptation] = 5
     return pd
 
 
-def save_data(data: ndarray, filename: str) -> None:
+def save_data(key: Dict, result: Training_Result, root: str = "data/") -> None:
     """
-    Serializes a training data set
-    :param data: The data set
-    :param filename: The identifier of the file
+    Saves a training result, with all its agents, in the result store
+    :param key: The key of the training, as returned by result_store.make_key
+    :param result: The result of shape (repetitions, agents, episodes)
+    :param root: The folder of the store. Default: "data/"
     """
-    zipped = tuple(zip(*data))
-    filename = filename.replace("\n", "")
-    with open(f'data/agent_{filename}.p', "wb") as dest:
-        pickle.dump(zipped[0], dest)
+    Result_Store(root).write(key, result)
 
 
-def read_data(path: str) -> Tuple:
+def read_data(game: str, mode: str, habituation: float, aspiration: float, learning_rate: float, nb_repetitions: int,
+              nb_episodes: int, data_type: str = "act_probs", root: str = "data/") -> ndarray:
     """
-    Deserializes stored data
-    :param path: Path to destination
-    :return: A tuple containing the data
+    Reads stored data without loading it in memory
+    :param game: "PD", "CH" or "SG"
+    :param mode: "classic", "fear" or "greed"
+    :param habituation: h
+    :param aspiration: A
+    :param learning_rate: l
+    :param nb_repetitions: Number of repetitions
+    :param nb_episodes: Number of episodes
+    :param data_type: "act_probs", "asp", "stim" or "actions". Default: "act_probs"
+    :param root: The folder of the store. Default: "data/"
+    :return: A memory-mapped view of shape (repetitions, agents, episodes)
     """
-    with open(path, "rb") as source:
-        data = pickle.load(source)
-    return data
+    key = make_key(game, mode, habituation, aspiration, learning_rate, nb_repetitions, nb_episodes)
+    return Result_Store(root).read(key, data_type)
 
 
-def compute_average_evolution(by_agent: Tuple) -> ndarray:
+def compute_average_evolution(data: ndarray) -> ndarray:
     """
     Computes the average evolution in time of the data
-    :param by_agent: A Tuple where the ith element contains the data of agent i. The elements are a List of repetitions
-    where each repetition contains the results of the a training set
-    :return: A list containing the averaged results across agents and repetitions.
+    :param data: An array of a training result, e.g. result.action_probabilities, of shape (repetitions, agents,
+    episodes)
+    :return: The results averaged across repetitions and agents at each episode
     """
-    out = numpy.zeros(len(by_agent[0][0]))
-    for i in range(len(by_agent)):
-        for repetition in by_agent[i]:
-            out = numpy.add(out, repetition)
-    return (out / len(by_agent)) / len(by_agent[0])
+    return numpy.asarray(data).mean(axis=(0, 1))
 
 
-def compute_propo_coop_mut(agent: Tuple) -> float:
-    count = 0
+def compute_propo_coop_mut(agent: ndarray,
+                           confidence: Optional[float] = None) -> Union[float, Tuple[float, float, float]]:
+    """
+    Computes the proportion of repetitions that converged to mutual cooperation
+    :param agent: The probabilities of cooperation of an agent, of shape (repetitions, episodes)
+    :param confidence: [optional] Confidence level of the interval returned with the proportion, e.g. 0.95. Default:
+    None, only the proportion is returned
+    :return: The proportion of repetitions where the probability of cooperation exceeds 0.9 at episode 100 (or 500
+    for trainings of at least 500 episodes), followed by the bounds of its Wilson score interval if a confidence level
+    is given
+    """
     index = 99 if len(agent[0]) < 500 else 499
-    for repetition in agent:
-        count += 1 if repetition[index] > 0.9 else 0
-    return count / len(agent)
+    converged = numpy.asarray(agent)[:, index] > 0.9
+    rate = float(numpy.mean(converged))
+    if confidence is None:
+        return rate
+    return (rate,) + wilson_interval(int(numpy.count_nonzero(converged)), len(converged), confidence)
+
+
+def wilson_interval(successes: int, nb_trials: int, confidence: float = 0.95) -> Tuple[float, float]:
+    """
+    :param successes: Number of successes
+    :param nb_trials: Number of trials
+    :param confidence: Confidence level. Default: 0.95
+    :return: The bounds of the Wilson score interval of the proportion of successes, which stays inside [0, 1] and
+    does not collapse when the proportion is 0 or 1
+    """
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    proportion = successes / nb_trials
+    center = (proportion + z ** 2 / (2 * nb_trials)) / (1 + z ** 2 / nb_trials)
+    half_width = z / (1 + z ** 2 / nb_trials) * math.sqrt(proportion * (1 - proportion) / nb_trials
+                                                          + z ** 2 / (4 * nb_trials ** 2))
+    return max(0.0, center - half_width), min(1.0, center + half_width)
+
+
+def mean_interval(values: ndarray, confidence: float = 0.95) -> Tuple[float, float]:
+    """
+    :param values: Samples of a quantity in [0, 1]
+    :param confidence: Confidence level. Default: 0.95
+    :return: The bounds of the normal confidence interval of the mean of the samples
+    """
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    mean = float(numpy.mean(values))
+    half_width = z * float(numpy.std(values, ddof=1)) / math.sqrt(len(values)) if len(values) > 1 else 1.0
+    return max(0.0, mean - half_width), min(1.0, mean + half_width)
 
 
 def train(game: Matrix_Payoffs, habituation: float, aspiration: float,
-          learning_rate: float, nb_repetitions: int, nb_episodes: int) -> Tuple[ndarray, ndarray, ndarray, ndarray]:
+          learning_rate: float, nb_repetitions: int, nb_episodes: int, engine: str = "classic",
+          seed: Optional[int] = None, first_repetition: int = 0,
+          absorbing_tolerance: Optional[float] = None, target_width: Optional[float] = None,
+          checkpoint: Optional[Checkpoint] = None) -> Training_Result:
     """
     Trains a set of agents on the given game
     :param game: The payoff matrix
@@ -93,45 +149,310 @@ def train(game: Matrix_Payoffs, habituation: float, aspiration: float,
     :param learning_rate: l
     :param nb_repetitions: Number of times the training will be repeated
     :param nb_episodes: Number of training episodes in each repetition
-    :return: A tuple containing: The probabilities of the actions of the agents, the aspirations of the agents and the
-    stimuli during training
-    """
-    action_probabilities = numpy.empty(nb_repetitions, dtype=object)
-    aspirations = numpy.empty(nb_repetitions, dtype=object)
-    stimuli = numpy.empty(nb_repetitions, dtype=object)
-    action = numpy.empty(nb_repetitions, dtype=object)
-    for repetition in range(nb_repetitions):
+    :param engine: "classic" to train each repetition with its own Bush_Mosteller model, "batch" to train all the
+    repetitions at once with a Batch_Bush_Mosteller model. Default: "classic"
+    :param seed: The root seed of the random streams of the repetitions. Default: None, not reproducible
+    :param first_repetition: Index of the first repetition, to train a chunk of a larger training. Default: 0
+    :param absorbing_tolerance: [optional] With the batch engine, tolerance below which repetitions locked in a
+    self-reinforcing equilibrium are filled in closed form instead of being simulated. Default: None, exact
+    :param target_width: [optional] Width of the confidence interval of the SRE rate at which the training stops, as
+    in train_adaptive, nb_repetitions being the cap. Default: None, nb_repetitions are trained
+    :param checkpoint: [optional] Checkpoint of the training, whose files receive the result. The training continues
+    from the checkpoint if it was restored, the batch engine saving its state at the end of blocks of uniforms and the
+    classic engine after whole repetitions. Requires a seed. Default: None
+    :return: The probabilities of cooperation, the aspirations, the stimuli and the actions of the agents during
+    training, as arrays of shape (repetitions, agents, episodes)
+    """
+    if target_width is not None:
+        return train_adaptive(game, habituation, aspiration, learning_rate, nb_repetitions, nb_episodes, target_width,
+                              engine=engine, seed=seed, absorbing_tolerance=absorbing_tolerance)
+    if checkpoint is None:
+        result = Training_Result.allocate((nb_repetitions, game.num_agents, nb_episodes))
+    else:
+        result = checkpoint.result
+    generators = spawn_generators(seed, first_repetition, nb_repetitions)
+    if engine == "batch":
+        model = Batch_Bush_Mosteller(game, nb_repetitions, learning_rate, aspiration, habituation,
+                                     generators=generators, absorbing_tolerance=absorbing_tolerance)
+        model.run(nb_episodes, result, checkpoint=checkpoint)
+        return result
+    elif engine != "classic":
+        raise ValueError(f"Unknown engine: {engine}")
+    for repetition in range(0 if checkpoint is None else checkpoint.progress, nb_repetitions):
         agents = [Agent(learning_rate, aspiration, habituation) for _ in range(game.num_agents)]
-        model = Bush_Mosteller(agents, game)
+        model = Bush_Mosteller(agents, game, generators[repetition])
+        model.run(nb_episodes, result[repetition])
+        if checkpoint is not None and repetition < nb_repetitions - 1 and checkpoint.due():
+            checkpoint.save(repetition + 1)
+    return result
+
+
+def train_adaptive(game: Matrix_Payoffs, habituation: float, aspiration: float, learning_rate: float,
+                   max_repetitions: int, nb_episodes: int, target_width: float,
+                   batch_size: int = ADAPTIVE_BATCH_SIZE, statistic: str = "sre", episode: Optional[int] = None,
+                   confidence: float = 0.95, engine: str = "batch", seed: Optional[int] = None,
+                   absorbing_tolerance: Optional[float] = None) -> Training_Result:
+    """
+    Trains batches of repetitions until the confidence interval of a statistic of agent 0 is narrower than the target
+    width, or until the cap is reached. Points where the statistic is clearly 0 or 1 stop after a few batches, while
+    the transition points get the repetitions they need. The repetitions are the first ones of the training with the
+    same seed, whatever the batch size.
+    :param game: The payoff matrix
+    :param habituation: h
+    :param aspiration: A
+    :param learning_rate: l
+    :param max_repetitions: The cap on the number of repetitions
+    :param nb_episodes: Number of training episodes in each repetition
+    :param target_width: Width of the confidence interval at which the training stops
+    :param batch_size: Number of repetitions trained between two checks. Default: ADAPTIVE_BATCH_SIZE
+    :param statistic: "sre" for the SRE rate of compute_propo_coop_mut (Wilson score interval), "cooperation" for the
+    mean probability of cooperation at the given episode (normal interval). Default: "sre"
+    :param episode: [optional] The episode of the "cooperation" statistic. Default: the last one
+    :param confidence: Confidence level of the interval. Default: 0.95
+    :param engine: "classic" or "batch". Default: "batch"
+    :param seed: The root seed of the random streams of the repetitions. Default: None, drawn once for all batches
+    :param absorbing_tolerance: [optional] As in train. Default: None
+    :return: The same result as train, of shape (repetitions reached, agents, episodes)
+    """
+    if seed is None:
+        seed = numpy.random.SeedSequence().entropy
+    if episode is None:
+        episode = nb_episodes - 1
+    # The cap is allocated without being initialized, so only the repetitions reached use memory
+    result = Training_Result.allocate((max_repetitions, game.num_agents, nb_episodes))
+    reached = 0
+    while reached < max_repetitions:
+        size = min(batch_size, max_repetitions - reached)
+        for dest, source in zip(result[reached:reached + size].as_tuple(),
+                                train(game, habituation, aspiration, learning_rate, size, nb_episodes, engine, seed,
+                                      first_repetition=reached, absorbing_tolerance=absorbing_tolerance).as_tuple()):
+            dest[...] = source
+        reached += size
+        agent = result.action_probabilities[:reached, 0]
+        if statistic == "sre":
+            _, low, high = compute_propo_coop_mut(agent, confidence)
+        elif statistic == "cooperation":
+            low, high = mean_interval(agent[:, episode], confidence)
+        else:
+            raise ValueError(f"Unknown statistic: {statistic}")
+        if high - low <= target_width:
+            break
+    return result[:reached]
+
+
+def train_pairings(game: Matrix_Payoffs, agent_types: Sequence[Agent_Type], nb_repetitions: int, nb_episodes: int,
+                   engine: str = "batch", seed: Optional[int] = None) -> Dict[Tuple[str, str], Training_Result]:
+    """
+    Trains every pairing of the given agent types, e.g. a fast learner against a slow one or a high aspiration against
+    a low one. The batch engine simulates all the pairings at once, each agent having its own parameters, and every
+    pairing gives the same result as with the classic engine and the same seed.
+    :param game: The payoff matrix
+    :param agent_types: The types of agents, with distinct names
+    :param nb_repetitions: Number of times each training will be repeated
+    :param nb_episodes: Number of training episodes in each repetition
+    :param engine: "classic" or "batch". Default: "batch"
+    :param seed: The root seed of the random streams of the repetitions, shared by all the pairings. Default: None,
+    not reproducible
+    :return: The result of every pairing of types (type of agent 0, type of agent 1), each pair of types appearing
+    once as the games are symmetric
+    """
+    pairings = list(itertools.combinations_with_replacement(agent_types, 2))
+    if seed is None:
+        seed = numpy.random.SeedSequence().entropy
+    if engine == "classic":
+        results = dict()
+        for pairing in pairings:
+            generators = spawn_generators(seed, 0, nb_repetitions)
+            result = Training_Result.allocate((nb_repetitions, game.num_agents, nb_episodes))
+            for repetition in range(nb_repetitions):
+                agents = [Agent(*agent_type[1:]) for agent_type in pairing]
+                Bush_Mosteller(agents, game, generators[repetition]).run(nb_episodes, result[repetition])
+            results[tuple(agent_type.name for agent_type in pairing)] = result
+        return results
+    elif engine != "batch":
+        raise ValueError(f"Unknown engine: {engine}")
+    # Arrays of shape (pairings, agents) of each parameter
+    learning_rates, aspirations, habituations, probab_inits = numpy.asarray(
+        [[agent_type[1:] for agent_type in pairing] for pairing in pairings], dtype=numpy.float64).transpose(2, 0, 1)
+    result = Training_Result.allocate((len(pairings), nb_repetitions, game.num_agents, nb_episodes))
+    model = Batch_Bush_Mosteller(game, nb_repetitions, learning_rates, aspirations, habituations, probab_inits,
+                                 generators=spawn_generators(seed, 0, nb_repetitions))
+    model.run(nb_episodes, result)
+    return {tuple(agent_type.name for agent_type in pairing): result[i] for i, pairing in enumerate(pairings)}
+
+
+def train_sweep(games: Sequence[Matrix_Payoffs], habituations: Sequence[float], aspirations: Sequence[float],
+                learning_rates: Sequence[float], nb_repetitions: int, nb_episodes: int,
+                seed: Optional[int] = None, first_repetition: int = 0) -> Training_Result:
+    """
+    Trains several parameter sets in lockstep, the ith set being made of the ith element of every sequence
+    :param games: The payoff matrix of each set
+    :param habituations: h of each set
+    :param aspirations: A of each set
+    :param learning_rates: l of each set
+    :param nb_repetitions: Number of times the training will be repeated
+    :param nb_episodes: Number of training episodes in each repetition
+    :param seed: The root seed of the random streams of the repetitions, shared by all the sets so that each set gives
+    the same result as train with the same seed. Default: None, not reproducible
+    :param first_repetition: Index of the first repetition, to train a chunk of a larger training. Default: 0
+    :return: The same result as train, with an additional leading axis indexing the parameter sets
+    """
+    result = Training_Result.allocate((len(games), nb_repetitions, games[0].num_agents, nb_episodes))
+    model = Batch_Bush_Mosteller(games, nb_repetitions, learning_rates, aspirations, habituations,
+                                 generators=spawn_generators(seed, first_repetition, nb_repetitions))
+    model.run(nb_episodes, result)
+    return result
 
-        model.run(nb_episodes)
-        action_probabilities[repetition] = model.get_action_probabilities()
-        aspirations[repetition] = model.get_aspirations()
-        stimuli[repetition] = model.get_stimuli_agent()
-        action[repetition] = model.get_action()
-    return action_probabilities, aspirations, stimuli, action
+
+def train_streaming(game: Union[Matrix_Payoffs, Sequence[Matrix_Payoffs]], habituation, aspiration, learning_rate,
+                    nb_repetitions: int, nb_episodes: int, reducers: Sequence[Reducer],
+                    chunk_size: int = STREAMING_CHUNK_SIZE, seed: Optional[int] = None) -> Sequence[Reducer]:
+    """
+    Trains a set of agents while only updating the given reducers, so that the memory used does not grow with the
+    number of repetitions times the number of episodes
+    :param game: The payoff matrix, or one matrix per parameter set as in train_sweep
+    :param habituation: h, or one value per parameter set
+    :param aspiration: A, or one value per parameter set
+    :param learning_rate: l, or one value per parameter set
+    :param nb_repetitions: Number of times the training will be repeated
+    :param nb_episodes: Number of training episodes in each repetition
+    :param reducers: The reducers updated at every episode
+    :param chunk_size: Number of repetitions simulated at once. Default: STREAMING_CHUNK_SIZE
+    :param seed: The root seed of the random streams of the repetitions. Default: None, not reproducible
+    :return: The reducers
+    """
+    if seed is None:
+        seed = numpy.random.SeedSequence().entropy
+    for start in range(0, nb_repetitions, chunk_size):
+        size = min(chunk_size, nb_repetitions - start)
+        model = Batch_Bush_Mosteller(game, size, learning_rate, aspiration, habituation,
+                                     generators=spawn_generators(seed, start, size))
+        model.run(nb_episodes, reducers=reducers, record=False)
+    return reducers
+
+
+def train_population(game: Matrix_Payoffs, habituation, aspiration, learning_rate, nb_agents: int, nb_episodes: int,
+                     reducers: Sequence[Reducer], edges: Optional[ndarray] = None,
+                     seed: Optional[int] = None) -> Sequence[Reducer]:
+    """
+    Trains a population of agents, re-paired at random at every episode or playing with their neighbours in a graph
+    :param game: The payoff matrix
+    :param habituation: h, or one value per agent
+    :param aspiration: A, or one value per agent
+    :param learning_rate: l, or one value per agent
+    :param nb_agents: Number of agents
+    :param nb_episodes: Number of training episodes
+    :param reducers: The reducers updated at every episode, the population being seen as a single repetition
+    :param edges: [optional] The edges of the interaction graph, e.g. population.lattice_edges. Default: random pairing
+    :param seed: The seed of the random stream of the population. Default: None, not reproducible
+    :return: The reducers
+    """
+    model = Population_Bush_Mosteller(game, nb_agents, learning_rate, aspiration, habituation, edges=edges,
+                                      rng=spawn_generators(seed, 0, 1)[0])
+    model.run(nb_episodes, reducers=reducers)
+    return reducers
+
+
+def train_cached(cache: Result_Cache, game: Matrix_Payoffs, habituation: float, aspiration: float,
+                 learning_rate: float, nb_repetitions: int, nb_episodes: int, engine: str = "classic",
+                 seed: int = 0) -> Training_Result:
+    """
+    Trains a set of agents on the given game, only computing the repetitions that are not in the cache yet
+    :param cache: The cache
+    :param seed: The root seed of the random streams of the repetitions
+    :return: The same result as train, served from the cache
+    """
+    key = cache_key(game.get_payoffs_vector(), habituation, aspiration, learning_rate, nb_episodes, seed,
+                    ENGINE_VERSION)
+    stored = cache.stored_repetitions(key)
+    if stored < nb_repetitions:
+        cache.append(key, stored, train(game, habituation, aspiration, learning_rate, nb_repetitions - stored,
+                                        nb_episodes, engine, seed, first_repetition=stored))
+    result = cache.read(key, nb_repetitions)
+    if result is None:
+        # The entry was evicted by another process in the meantime
+        result = train(game, habituation, aspiration, learning_rate, nb_repetitions, nb_episodes, engine, seed)
+    return result
+
+
+def get_cache_key(game_name: str, parameters: List[str], seed: int) -> str:
+    """
+    :param game_name: "PD", "CH" or "SG"
+    :param parameters: The parameter set in the source file format
+    :param seed: The root seed of the training
+    :return: The key of the training in the cache
+    """
+    return cache_key(get_game(game_name, parameters[0]).get_payoffs_vector(), *parameters[1:4], parameters[5], seed,
+                     ENGINE_VERSION)
 
 
 def main() -> List[List[str]]:
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("arguments", nargs="*")
+    parser.add_argument("--engine", choices=ENGINES, default="classic")
+    parser.add_argument("--sweep-size", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--cache", action="store_true")
+    parser.add_argument("--cache-size", type=int, default=None)
+    parser.add_argument("--timers", action="store_true")
+    parser.add_argument("--profile", default=None)
+    parser.add_argument("--target-width", type=float, default=None)
+    parser.add_argument("--write-buffer", type=int, default=None)
+    parser.add_argument("--checkpoint", action="store_true")
+    parser.add_argument("--checkpoint-interval", type=float, default=CHECKPOINT_INTERVAL)
+    args = parser.parse_args()
+
     parameters_list = list()
-    if len(sys.argv) == 7:
-        parameters_list.append(sys.argv[1:])
-    elif len(sys.argv) == 2:
-        with open(sys.argv[1], "r") as parameters_file:
+    if len(args.arguments) == 6:
+        parameters_list.append(args.arguments)
+    elif len(args.arguments) == 1:
+        with open(args.arguments[0], "r") as parameters_file:
             lines = parameters_file.readlines()
         for line in lines:
-            parameters_list.append(line.split(" "))
+            if line.strip():
+                parameters_list.append(line.split(" "))
     else:
         print("Invalid arguments")
-        print("Usage: python runner.py [mode] habituation aspiration learning_rate nb_repetitions "
-              "nb_episodes\n\tOR\n       python runner.py source_file\n\t- mode:\n\t\t- classic\n\t\t- fear\n\t\t- "
-              "greed\t\n\t- source_file: File where each line contains a set of arguments")
+        print("Usage: python runner.py [options] [mode] habituation aspiration learning_rate nb_repetitions "
+              "nb_episodes\n\tOR\n       python runner.py [options] source_file\n\t- mode:\n\t\t- classic\n\t\t- "
+              "fear\n\t\t- greed\t\n\t- source_file: File where each line contains a set of arguments\n\t- options:"
+              "\n\t\t--engine classic|batch|sweep\n\t\t--sweep-size nb_sets\n\t\t--workers nb_processes"
+              "\n\t\t--seed root_seed\n\t\t--cache\n\t\t--cache-size megabytes\n\t\t--timers\n\t\t--profile folder"
+              "\n\t\t--target-width width\n\t\t--write-buffer megabytes\n\t\t--checkpoint"
+              "\n\t\t--checkpoint-interval seconds")
+        return []
+    if args.cache and args.seed is None:
+        print("--cache requires --seed")
+        return []
+    if args.target_width is not None and (args.cache or args.workers is not None):
+        print("--target-width cannot be combined with --cache or --workers")
+        return []
+    if args.checkpoint and (args.seed is None or args.target_width is not None or args.cache):
+        print("--checkpoint requires --seed and cannot be combined with --target-width or --cache")
         return []
 
     if not os.path.exists("data/"):
         os.makedirs("data/")
+    cache = None
+    if args.cache:
+        cache = Result_Cache(max_bytes=None if args.cache_size is None else args.cache_size * 1024 * 1024)
+    instrumentation = None
+    if args.timers or args.profile is not None:
+        instrumentation = Instrumentation(args.timers, args.profile)
+
+    if args.workers is not None:
+        # Tasks are single parameter sets, so the sweep engine falls back to the batch engine
+        schedule(parameters_list, ["PD", "CH", "SG"], args.workers, "classic" if args.engine == "classic" else "batch",
+                 seed=args.seed, cache=cache, instrumentation=instrumentation, resume=args.checkpoint)
+        return parameters_list
 
-    processes = [Process(target=train_by_game, args=(parameters_list, game)) for game in ["PD", "CH", "SG"]]
+    write_buffer = WRITER_MEMORY_LIMIT if args.write_buffer is None else args.write_buffer * 1024 * 1024
+    checkpoint_interval = args.checkpoint_interval if args.checkpoint else None
+    processes = [Process(target=train_by_game,
+                         args=(parameters_list, game, args.engine, args.sweep_size, args.seed, cache, instrumentation,
+                               args.target_width, write_buffer, checkpoint_interval))
+                 for game in ["PD", "CH", "SG"]]
     for process in processes:
         process.start()
     for process in processes:
@@ -139,23 +460,203 @@ def main() -> List[List[str]]:
     return parameters_list
 
 
-def train_by_game(parameters_list: List[str], game_name: str):
-    count = 0
-    for i, parameters in enumerate(parameters_list):
-        count += 1
-        print("({0}/{1}) Training: game={2} mode={3} "
-              "h={4} A={5} l={6} reps={7} eps={8}".format(str(count), len(parameters_list), game_name,
-                                                          *parameters))
+def train_by_game(parameters_list: List[List[str]], game_name: str, engine: str = "classic",
+                  sweep_size: Optional[int] = None, seed: Optional[int] = None, cache: Optional[Result_Cache] = None,
+                  instrumentation: Optional[Instrumentation] = None, target_width: Optional[float] = None,
+                  write_buffer: int = WRITER_MEMORY_LIMIT, checkpoint_interval: Optional[float] = None):
+    """
+    Trains and saves every parameter set of the list on one game
+    :param parameters_list: List of parameter sets in the source file format
+    :param game_name: "PD", "CH" or "SG"
+    :param engine: "classic" or "batch" to train the parameter sets one after another, "sweep" to train the parameter
+    sets sharing the same number of repetitions and episodes in lockstep. Default: "classic"
+    :param sweep_size: Maximum number of parameter sets trained in lockstep by the "sweep" engine. Default: all
+    :param seed: The root seed of every training. Default: None, not reproducible
+    :param cache: [optional] Cache serving the trainings already computed with the same seed. Requires a seed
+    :param instrumentation: [optional] Timers and profiling of the process. Default: None
+    :param target_width: [optional] Width of the confidence interval of the SRE rate at which each training stops,
+    the number of repetitions of the parameter set being the cap. The sweep engine then falls back to the batch
+    engine, as the sets stop after different numbers of repetitions. Default: None
+    :param write_buffer: Bytes of results waiting to be written at most, the results being written by a background
+    thread while the next parameter sets train. Default: WRITER_MEMORY_LIMIT
+    :param checkpoint_interval: [optional] Minimum number of seconds between two checkpoints of a training. The
+    parameter sets done by a previous run with the same seed are skipped and an interrupted training continues from
+    its last checkpoint. The sweep engine then falls back to the batch engine, each set having its own checkpoints.
+    Requires a seed. Default: None, no checkpoint
+    """
+    with worker(instrumentation, game_name) as timers, Result_Writer(write_buffer) as writer:
+        if checkpoint_interval is not None:
+            parameters_list = filter_done(parameters_list, game_name, seed)
+        if cache is not None:
+            parameters_list = filter_cached(parameters_list, game_name, seed, cache)
+        if engine == "sweep" and target_width is None and checkpoint_interval is None:
+            train_sweep_by_game(parameters_list, game_name, sweep_size, seed, cache, writer)
+        else:
+            train_sets_by_game(parameters_list, game_name, "batch" if engine == "sweep" else engine, seed, cache,
+                               target_width, writer, checkpoint_interval)
+    if timers is not None:
+        print("Timers: game={0}\n{1}".format(game_name, timers.report()), flush=True)
+
+
+def train_sets_by_game(parameters_list: List[List[str]], game_name: str, engine: str = "classic",
+                       seed: Optional[int] = None, cache: Optional[Result_Cache] = None,
+                       target_width: Optional[float] = None, writer: Optional[Result_Writer] = None,
+                       checkpoint_interval: Optional[float] = None):
+    """
+    Trains and saves every parameter set of the list on one game, one after another
+    :param parameters_list: List of parameter sets in the source file format
+    :param game_name: "PD", "CH" or "SG"
+    :param engine: "classic" or "batch". Default: "classic"
+    :param seed: The root seed of every training. Default: None, not reproducible
+    :param cache: [optional] Cache serving the trainings already computed with the same seed. Requires a seed
+    :param target_width: [optional] Width of the confidence interval of the SRE rate at which each training stops.
+    The number of repetitions reached is recorded in the store entry. Default: None
+    :param writer: [optional] Writer saving the results in the background. Default: None, saved before the next set
+    :param checkpoint_interval: [optional] Minimum number of seconds between two checkpoints of a training, the
+    trainings being written directly to the store and recorded in the journal of the sweep once done. Requires a
+    seed. Default: None, no checkpoint
+    """
+    progress = Progress(sum(int(parameters[4]) * int(parameters[5]) for parameters in parameters_list))
+    for parameters in parameters_list:
         floats = numpy.asarray(parameters[1:4], dtype=float)
         ints = numpy.asarray(parameters[4:], dtype=int)
-        game = Matrix_Payoffs(get_payoffs_vector(game_name, "fear" == parameters[0], "greed" == parameters[0]))
-        action_probabilities, aspirations, stimuli, action = train(game, *floats, *ints)
-        filename = game_name + "_" + "_".join(parameters)
-        filename = filename.replace(".", "-")
-        save_data(action_probabilities, "act_probs_" + filename)
-        save_data(aspirations, "asp_" + filename)
-        save_data(stimuli, "stim_" + filename)
-        save_data(action, "actions_" + filename)
+        game = get_game(game_name, parameters[0])
+        if checkpoint_interval is not None:
+            checkpoint = Checkpoint(make_key(game_name, *parameters), game.num_agents, seed,
+                                    "{0}-{1}".format(engine, ENGINE_VERSION), checkpoint_interval)
+            if checkpoint.progress:
+                print("Resumed: game={0} mode={1} h={2} A={3} l={4} reps={5} eps={6} from {7} {8}".format(
+                    game_name, *(value.strip() for value in parameters), checkpoint.progress,
+                    "episodes" if engine == "batch" else "repetitions"), flush=True)
+            train(game, *floats, *ints, engine=engine, seed=seed, checkpoint=checkpoint)
+            checkpoint.complete()
+        elif target_width is not None:
+            result = train(game, *floats, *ints, engine=engine, seed=seed, target_width=target_width)
+            save_training(game_name, parameters, result, writer, nb_repetitions_reached=result.nb_repetitions)
+        elif cache is None:
+            save_training(game_name, parameters, train(game, *floats, *ints, engine=engine, seed=seed), writer)
+        else:
+            save_training(game_name, parameters, train_cached(cache, game, *floats, *ints, engine, seed), writer,
+                          cache_key=get_cache_key(game_name, parameters, seed))
+        progress.update(ints[0] * ints[1], "Trained: game={0} mode={1} h={2} A={3} l={4} reps={5} eps={6}".format(
+            game_name, *(value.strip() for value in parameters)), len(parameters_list))
+
+
+def train_sweep_by_game(parameters_list: List[List[str]], game_name: str, sweep_size: Optional[int] = None,
+                        seed: Optional[int] = None, cache: Optional[Result_Cache] = None,
+                        writer: Optional[Result_Writer] = None):
+    """
+    Trains and saves every parameter set of the list on one game, stacking the sets that share the same number of
+    repetitions and episodes into a single lockstep simulation. With a cache, the sets are also grouped by the number
+    of repetitions already cached, and only the missing repetitions are trained
+    :param parameters_list: List of parameter sets in the source file format
+    :param game_name: "PD", "CH" or "SG"
+    :param sweep_size: Maximum number of parameter sets trained in lockstep. Default: all
+    :param seed: The root seed of every training. Default: None, not reproducible
+    :param cache: [optional] Cache serving the repetitions already computed with the same seed. Requires a seed
+    :param writer: [optional] Writer saving the results in the background. Default: None, saved before the next sweep
+    """
+    groups = dict()
+    for parameters in parameters_list:
+        stored = 0 if cache is None else cache.stored_repetitions(get_cache_key(game_name, parameters, seed))
+        groups.setdefault((stored, *(int(value) for value in parameters[4:])), []).append(parameters)
+    progress = Progress(sum((nb_repetitions - stored) * nb_episodes * len(group)
+                            for (stored, nb_repetitions, nb_episodes), group in groups.items()))
+    for (stored, nb_repetitions, nb_episodes), group in groups.items():
+        step = sweep_size or len(group)
+        for start in range(0, len(group), step):
+            sweep = group[start:start + step]
+            floats = numpy.asarray([parameters[1:4] for parameters in sweep], dtype=float)
+            games = [get_game(game_name, parameters[0]) for parameters in sweep]
+            results = train_sweep(games, floats[:, 0], floats[:, 1], floats[:, 2], nb_repetitions - stored,
+                                  nb_episodes, seed, first_repetition=stored)
+            for i, parameters in enumerate(sweep):
+                if cache is None:
+                    save_training(game_name, parameters, results[i], writer)
+                    continue
+                key = get_cache_key(game_name, parameters, seed)
+                cache.append(key, stored, results[i])
+                result = results[i] if stored == 0 else cache.read(key, nb_repetitions)
+                if result is None:
+                    # The entry was evicted by another process in the meantime
+                    result = train(games[i], *floats[i], nb_repetitions, nb_episodes, "batch", seed)
+                save_training(game_name, parameters, result, writer, cache_key=key)
+            progress.update(len(sweep) * (nb_repetitions - stored) * nb_episodes,
+                            "Trained sweep: game={0} sets={1}-{2}/{3} reps={4}-{5} eps={6}".format(
+                                game_name, start + 1, start + len(sweep), len(group), stored, nb_repetitions,
+                                nb_episodes))
+
+
+def get_game(game_name: str, mode: str) -> Matrix_Payoffs:
+    """
+    :param game_name: "PD", "CH" or "SG"
+    :param mode: "classic", "fear" or "greed", or a parametric mode as described in game_kernel.apply_mode, e.g.
+    "fear=-2" or "T=5,S=-0.5"
+    :return: The payoff matrix of the game
+    """
+    return Matrix_Payoffs(apply_mode(get_payoffs_vector(game_name), mode))
+
+
+def filter_done(parameters_list: List[List[str]], game_name: str, seed: int, root: str = "data/") -> List[List[str]]:
+    """
+    Skips the parameter sets that a previous run of the sweep finished with the same seed, according to its journal,
+    and whose store entry still holds the trainings of this seed
+    :param parameters_list: List of parameter sets in the source file format
+    :param game_name: "PD", "CH" or "SG"
+    :param seed: The root seed of every training
+    :param root: The folder of the result store. Default: "data/"
+    :return: The parameter sets that still have to be trained, at least partially
+    """
+    done = Sweep_Journal(root).get_done(seed)
+    store = Result_Store(root)
+    remaining = []
+    for parameters in parameters_list:
+        key = make_key(game_name, *parameters)
+        entry = store.get_entry(key)
+        if entry_name(key) in done and entry is not None and entry.get("seed") == seed:
+            print("Done: game={0} mode={1} h={2} A={3} l={4} reps={5} eps={6}".format(
+                game_name, *(value.strip() for value in parameters)))
+        else:
+            remaining.append(parameters)
+    return remaining
+
+
+def filter_cached(parameters_list: List[List[str]], game_name: str, seed: int,
+                  cache: Result_Cache) -> List[List[str]]:
+    """
+    Serves the parameter sets already computed from the cache
+    :param parameters_list: List of parameter sets in the source file format
+    :param game_name: "PD", "CH" or "SG"
+    :param seed: The root seed of every training
+    :param cache: The cache
+    :return: The parameter sets that still have to be trained, at least partially
+    """
+    store = Result_Store()
+    remaining = []
+    for parameters in parameters_list:
+        if serve(cache, store, make_key(game_name, *parameters), get_cache_key(game_name, parameters, seed)):
+            print("Cached: game={0} mode={1} h={2} A={3} l={4} reps={5} eps={6}".format(
+                game_name, *(value.strip() for value in parameters)))
+        else:
+            remaining.append(parameters)
+    return remaining
+
+
+def save_training(game_name: str, parameters: List[str], result: Training_Result,
+                  writer: Optional[Result_Writer] = None, **metadata):
+    """
+    Saves the results of a training in the result store of the data folder
+    :param game_name: "PD", "CH" or "SG"
+    :param parameters: The parameter set in the source file format
+    :param result: The result returned by train
+    :param writer: [optional] Writer saving the result in the background, which may wait for the results in flight to
+    be written first. Default: None, the result is written before returning
+    :param metadata: [optional] Additional fields of the store entry
+    """
+    if writer is None:
+        Result_Store().write(make_key(game_name, *parameters), result, **metadata)
+    else:
+        writer.submit(make_key(game_name, *parameters), result, **metadata)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,176 @@
+import math
+from multiprocessing import Pool
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy
+
+from checkpoint import Sweep_Journal, get_missing_ranges
+from instrumentation import Instrumentation, Phase_Timers, Progress, worker
+from result_cache import Result_Cache, serve
+from result_store import Result_Store, entry_name, make_key
+
+# Number of tasks per worker, so that workers finishing early can pick up the remaining work
+TASKS_PER_WORKER = 4
+
+
+class Task(NamedTuple):
+    game_name: str
+    parameters: List[str]
+    start: int
+    nb_repetitions: int
+    engine: str
+    seed: int
+    root: str
+    instrumentation: Optional[Instrumentation] = None
+
+
+def split_tasks(points: List[Tuple[str, List[str], List[Tuple[int, int]]]], nb_workers: int, engine: str = "batch",
+                seed: Optional[int] = None, root: str = "data/",
+                instrumentation: Optional[Instrumentation] = None) -> List[Task]:
+    """
+    Splits a sweep into tasks of one (game, mode, parameter set, chunk of repetitions) each. The chunks are sized so
+    that the sweep gives about TASKS_PER_WORKER tasks per worker.
+    :param points: The trainings of the sweep, as (game, parameter set in the source file format, (start, stop) ranges
+    of the repetitions to train) triplets
+    :param nb_workers: Number of worker processes
+    :param engine: The engine used by train. Default: "batch"
+    :param seed: The root seed of every training. Default: None, drawn once for the whole sweep
+    :param root: The folder of the result store. Default: "data/"
+    :param instrumentation: [optional] Timers and profiling of the workers. Default: None
+    :return: The tasks, the longest first
+    """
+    if seed is None:
+        seed = numpy.random.SeedSequence().entropy
+    work = sum((stop - start) * int(parameters[5]) for _, parameters, ranges in points for start, stop in ranges)
+    work_per_task = max(1, work // (nb_workers * TASKS_PER_WORKER))
+    tasks = []
+    for game_name, parameters, ranges in points:
+        for first, stop in ranges:
+            chunk = min(stop - first, math.ceil(work_per_task / int(parameters[5])))
+            for start in range(first, stop, chunk):
+                tasks.append(Task(game_name, parameters, start, min(chunk, stop - start), engine, seed, root,
+                                  instrumentation))
+    tasks.sort(key=lambda task: task.nb_repetitions * int(task.parameters[5]), reverse=True)
+    return tasks
+
+
+def run_task(task: Task) -> Tuple[Task, Optional[Phase_Timers]]:
+    """
+    Trains a chunk of repetitions and saves it as a part of its training
+    :param task: The task
+    :return: The task, once done, and its timers if they were requested
+    """
+    # Imported here as runner imports this module
+    from runner import get_game, train
+
+    with worker(task.instrumentation, "worker") as timers:
+        mode, habituation, aspiration, learning_rate, _, nb_episodes = task.parameters
+        result = train(get_game(task.game_name, mode), float(habituation), float(aspiration), float(learning_rate),
+                       task.nb_repetitions, int(nb_episodes), engine=task.engine, seed=task.seed,
+                       first_repetition=task.start)
+        Result_Store(task.root).write_part(make_key(task.game_name, *task.parameters), task.start, result)
+    return task, timers
+
+
+def schedule(parameters_list: List[List[str]], games: List[str], nb_workers: int, engine: str = "batch",
+             seed: Optional[int] = None, root: str = "data/", cache: Optional[Result_Cache] = None,
+             instrumentation: Optional[Instrumentation] = None, resume: bool = False) -> None:
+    """
+    Trains a sweep on a pool of worker processes. Idle workers take the next pending task, and the chunks of a
+    training are merged into its files as soon as all of them are done. With a cache, only the repetitions missing
+    from the cache are trained. When resuming, the trainings recorded as done in the journal of the sweep are skipped
+    and the chunks saved by an interrupted run are reused, the parts serving as checkpoints.
+    :param parameters_list: List of parameter sets in the source file format
+    :param games: The games to train on
+    :param nb_workers: Number of worker processes
+    :param engine: The engine used by train: "classic" or "batch". Default: "batch"
+    :param seed: The root seed of every training. Default: None, not reproducible
+    :param root: The folder of the result store. Default: "data/"
+    :param cache: [optional] Cache serving the trainings already computed with the same seed. Requires a seed
+    :param instrumentation: [optional] Timers and profiling of the workers, the timers being summed over all the
+    workers. Default: None
+    :param resume: True to skip the trainings done and reuse the chunks of an interrupted run with the same seed,
+    which is required. Default: False, the chunks of previous runs are discarded
+    """
+    # Imported here as runner imports this module
+    from runner import filter_cached, filter_done, get_cache_key
+
+    if seed is None:
+        seed = numpy.random.SeedSequence().entropy
+    store = Result_Store(root)
+    points = []
+    for game_name in games:
+        to_train = parameters_list if not resume else filter_done(parameters_list, game_name, seed, root)
+        if cache is not None:
+            to_train = filter_cached(to_train, game_name, seed, cache)
+        for parameters in to_train:
+            key = make_key(game_name, *parameters)
+            first = 0 if cache is None else cache.stored_repetitions(get_cache_key(game_name, parameters, seed))
+            if resume:
+                points.append((game_name, parameters, get_missing_ranges(store, key, seed, first)))
+            else:
+                store.remove_parts(key)
+                points.append((game_name, parameters, [(first, int(parameters[4]))]))
+    tasks = split_tasks(points, nb_workers, engine, seed, root, instrumentation)
+    remaining: Dict[str, int] = dict()
+    for task in tasks:
+        name = entry_name(make_key(task.game_name, *task.parameters))
+        remaining[name] = remaining.get(name, 0) + 1
+    # Trainings whose chunks were all saved by the interrupted run
+    for game_name, parameters, ranges in points:
+        if not ranges:
+            merge(store, game_name, parameters, seed, cache, resume)
+
+    progress = Progress(sum(task.nb_repetitions * int(task.parameters[5]) for task in tasks))
+    total_timers = Phase_Timers()
+    with Pool(nb_workers) as pool:
+        for task, timers in pool.imap_unordered(run_task, tasks, chunksize=1):
+            key = make_key(task.game_name, *task.parameters)
+            progress.update(task.nb_repetitions * int(task.parameters[5]),
+                            "Trained: game={0} mode={1} h={2} A={3} l={4} reps={6}-{7}/{5} eps={8}".format(
+                                task.game_name, *task.parameters[:4], task.parameters[4].strip(), task.start,
+                                task.start + task.nb_repetitions, task.parameters[5].strip()), len(tasks))
+            if timers is not None:
+                total_timers.merge(timers)
+            remaining[entry_name(key)] -= 1
+            if remaining[entry_name(key)] == 0:
+                merge(store, task.game_name, task.parameters, seed, cache, resume)
+    if total_timers.calls:
+        print("Timers: all workers\n" + total_timers.report())
+
+
+def merge(store: Result_Store, game_name: str, parameters: List[str], seed: int, cache: Optional[Result_Cache] = None,
+          resume: bool = False) -> None:
+    """
+    Merges the chunks of a training into its store entry, through the cache if there is one
+    :param store: The result store
+    :param game_name: "PD", "CH" or "SG"
+    :param parameters: The parameter set in the source file format
+    :param seed: The root seed of the training
+    :param cache: [optional] Cache where the chunks are added. Default: None
+    :param resume: True to record the training in the journal of the sweep. Default: False
+    """
+    # Imported here as runner imports this module
+    from runner import get_cache_key, get_game, train
+
+    key = make_key(game_name, *parameters)
+    if cache is None:
+        store.merge_parts(key, seed=seed)
+    else:
+        cache_key = get_cache_key(game_name, parameters, seed)
+        parts = store.read_parts(key)
+        for start, part in parts:
+            cache.append(cache_key, start, part)
+        if serve(cache, store, key, cache_key):
+            store.remove_parts(key)
+        else:
+            # The repetitions cached before the sweep were evicted by another process in the meantime, so they are
+            # trained again and merged with the chunks
+            first = parts[0][0]
+            if first:
+                mode, habituation, aspiration, learning_rate, _, nb_episodes = parameters
+                store.write_part(key, 0, train(get_game(game_name, mode), float(habituation), float(aspiration),
+                                               float(learning_rate), first, int(nb_episodes), "batch", seed))
+            store.merge_parts(key, seed=seed, cache_key=cache_key)
+    if resume:
+        Sweep_Journal(store.root).record(key, seed)
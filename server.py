@@ -0,0 +1,360 @@
+import argparse
+import itertools
+import json
+import os
+import threading
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Pool
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import numpy
+
+from result_cache import Result_Cache, serve as serve_cached
+from result_store import KEY_FIELDS, Result_Store, entry_name, make_key
+from runner import get_cache_key, get_game
+from scheduler import merge, run_task, split_tasks
+from summary_index import SUMMARY_ARRAYS, load_index, summarize_task
+
+# Port of the server, which only listens on localhost
+SERVER_PORT = 8765
+GAMES = ["PD", "CH", "SG"]
+# Type of every key field, to read the criteria of the queries
+FIELD_TYPES = {"game": str, "mode": str, "habituation": float, "aspiration": float, "learning_rate": float,
+               "nb_repetitions": int, "nb_episodes": int}
+
+
+def parse_trainings(request: Dict) -> List[Tuple[str, List[str]]]:
+    """
+    Reads the trainings of a sweep specification
+    :param request: The specification: "games", the games to train on (default: all of them), "source", parameter
+    sets in the source file format, one per line, and/or "trainings", parameter sets given as objects of the key
+    fields ("mode", "habituation", "aspiration", "learning_rate", "nb_repetitions", "nb_episodes" and optionally
+    "game", the set then being trained on this game only)
+    :return: The (game, parameter set in the source file format) of every training
+    """
+    if not isinstance(request, dict):
+        raise ValueError("The specification must be an object")
+    games, source = request.get("games", GAMES), request.get("source", "")
+    trainings = request.get("trainings", [])
+    if (not isinstance(games, list) or not isinstance(source, str) or not isinstance(trainings, list)
+            or not all(isinstance(training, dict) for training in trainings)):
+        raise ValueError('"games" must be a list, "source" a string and "trainings" a list of objects')
+    parameters_list = []
+    for line in source.splitlines():
+        if line.strip():
+            parameters_list += [(game_name, line.split()) for game_name in games]
+    for training in trainings:
+        parameters = [str(training[field]) for field in KEY_FIELDS[1:]]
+        parameters_list += [(game_name, parameters)
+                            for game_name in ([training["game"]] if "game" in training else games)]
+    for game_name, parameters in parameters_list:
+        if game_name not in GAMES or len(parameters) != 6:
+            raise ValueError("Invalid training: game={0} parameters={1}".format(game_name, " ".join(parameters)))
+        # Raises a ValueError for an unknown mode or a parameter that is not a number
+        get_game(game_name, parameters[0])
+        make_key(game_name, *parameters)
+        if int(parameters[4]) <= 0 or int(parameters[5]) <= 0:
+            raise ValueError("Invalid training: game={0} parameters={1}".format(game_name, " ".join(parameters)))
+    return parameters_list
+
+
+class Job_Server:
+    def __init__(self, nb_workers: Optional[int] = None, engine: str = "batch", seed: Optional[int] = None,
+                 root: str = "data/", cache_size: Optional[int] = None):
+        """
+        Long-running service training the sweeps submitted by its clients on a pool of worker processes that stays
+        up, so that the imports and the start of the workers are paid once. Every training uses the seed of the
+        server and goes through the content-addressed cache of result_cache.py, keyed on the payoffs, the
+        parameters and the seed, so that the trainings of modes with the same payoffs (e.g. "fear" and "S=-1") are
+        computed once. A job is a list of trainings: the ones the cache can serve are saved in the store from it, the
+        ones already queued by another job are shared, and only the others are split into chunks of the repetitions
+        missing from the cache and trained. The store entries written by runner.py without the cache are trained
+        again with the seed of the server. Finished trainings are summarized by the workers into the summary index,
+        from which the queries are answered.
+
+        :param nb_workers: [optional] Number of worker processes. Default: the number of CPUs
+        :param engine: The engine used by train: "classic" or "batch". Default: "batch"
+        :param seed: [optional] The root seed of every training. Default: None, drawn when the server starts
+        :param root: The folder of the result store, the cache being [root]/cache/. Default: "data/"
+        :param cache_size: [optional] Size limit of the cache in bytes. Default: None, no limit
+        """
+        self.engine = engine
+        self.seed = numpy.random.SeedSequence().entropy if seed is None else seed
+        self.store = Result_Store(root)
+        self.cache = Result_Cache(os.path.join(root, "cache"), cache_size)
+        self.index = load_index(root, nb_workers)
+        self.nb_workers = os.cpu_count() if nb_workers is None else nb_workers
+        self.pool = Pool(self.nb_workers)
+        self.lock = threading.Lock()
+        self.index_lock = threading.Lock()
+        # State of every training requested, by entry name, shared by the entries trained together
+        self.trainings: Dict[str, Dict] = dict()
+        # Trainings in progress, by cache key and number of repetitions
+        self.pending: Dict[Tuple[str, int], Dict] = dict()
+        self.jobs: Dict[str, List[str]] = dict()
+        self.job_ids = itertools.count(1)
+
+    def close(self) -> None:
+        """
+        Stops the workers, the trainings in progress being dropped
+        """
+        self.pool.terminate()
+        self.pool.join()
+
+    def submit(self, request: Dict) -> Dict:
+        """
+        Queues a job
+        :param request: The sweep specification, as described in parse_trainings
+        :return: The status of the job, as returned by get_job
+        """
+        trainings = parse_trainings(request)
+        with self.lock:
+            names = []
+            for game_name, parameters in trainings:
+                key = make_key(game_name, *parameters)
+                name = entry_name(key)
+                if name in names:
+                    continue
+                names.append(name)
+                training = self.trainings.get(name)
+                if training is not None and training["status"] == "pending":
+                    continue
+                cache_key = get_cache_key(game_name, parameters, self.seed)
+                if serve_cached(self.cache, self.store, key, cache_key):
+                    self.trainings[name] = {"status": "done"}
+                elif (cache_key, key["nb_repetitions"]) in self.pending:
+                    # Another entry with the same payoffs, e.g. another name of the same mode, is being trained
+                    training = self.pending[cache_key, key["nb_repetitions"]]
+                    training["aliases"].append(key)
+                    self.trainings[name] = training
+                else:
+                    self.start(game_name, parameters, key, name, cache_key)
+            job = str(next(self.job_ids))
+            self.jobs[job] = names
+        return self.get_job(job)
+
+    def start(self, game_name: str, parameters: List[str], key: Dict, name: str, cache_key: str) -> None:
+        """
+        Queues the chunks of the repetitions of a training missing from the cache on the workers. Called with the
+        lock held
+        """
+        self.store.remove_parts(key)
+        first = self.cache.stored_repetitions(cache_key)
+        if first >= key["nb_repetitions"]:
+            # The entry was evicted by another process since the cache failed to serve it
+            first = 0
+        tasks = split_tasks([(game_name, parameters, [(first, key["nb_repetitions"])])], self.nb_workers, self.engine,
+                            self.seed, self.store.root)
+        training = {"status": "pending", "remaining": len(tasks), "aliases": [], "cache_key": cache_key,
+                    "nb_repetitions": key["nb_repetitions"]}
+        self.trainings[name] = training
+        self.pending[cache_key, key["nb_repetitions"]] = training
+        for task in tasks:
+            self.pool.apply_async(run_task, (task,), callback=partial(self.on_task_done, training),
+                                  error_callback=partial(self.on_error, training))
+
+    def on_task_done(self, training: Dict, done: Tuple) -> None:
+        """
+        Merges a training once all its chunks are done, saves the entries sharing it and queues their summaries
+        :param training: The state of the training
+        :param done: The task and its timers, as returned by scheduler.run_task
+        """
+        task, _ = done
+        with self.lock:
+            training["remaining"] -= 1
+            if training["remaining"] or training["status"] == "failed":
+                return
+            # Entries asking for the same training from now on are served by the cache
+            del self.pending[training["cache_key"], training["nb_repetitions"]]
+            aliases = list(training["aliases"])
+        key = make_key(task.game_name, *task.parameters)
+        try:
+            merge(self.store, task.game_name, task.parameters, self.seed, self.cache)
+            for alias in aliases:
+                self.store.write(alias, self.store.read_result(key), cache_key=training["cache_key"])
+            entries = [(entry_name(entry_key), self.store.get_entry(entry_key)) for entry_key in [key] + aliases]
+        except Exception as error:
+            self.on_error(training, error)
+            return
+        training["summaries"] = len(entries)
+        for name, entry in entries:
+            self.pool.apply_async(summarize_task, ((self.store.root, name, entry),),
+                                  callback=partial(self.on_summarized, training),
+                                  error_callback=partial(self.on_error, training))
+
+    def on_summarized(self, training: Dict, summary: Dict) -> None:
+        with self.index_lock:
+            self.index.add(summary)
+            self.index.save()
+        with self.lock:
+            training["summaries"] -= 1
+            if not training["summaries"] and training["status"] != "failed":
+                training["status"] = "done"
+
+    def on_error(self, training: Dict, error: BaseException) -> None:
+        with self.lock:
+            training["status"] = "failed"
+            training["error"] = "{0}: {1}".format(type(error).__name__, error)
+            pending_key = (training["cache_key"], training["nb_repetitions"])
+            if self.pending.get(pending_key) is training:
+                del self.pending[pending_key]
+
+    def get_job(self, job: str) -> Dict:
+        """
+        :param job: The identifier of the job
+        :return: The status of the job ("pending", "done" or "failed") and of each of its trainings
+        """
+        with self.lock:
+            if job not in self.jobs:
+                raise KeyError(f"No job {job}")
+            trainings = [dict({"name": name}, **{field: value for field, value in self.trainings[name].items()
+                                                 if field in ("status", "error")})
+                         for name in self.jobs[job]]
+        statuses = {training["status"] for training in trainings}
+        status = "failed" if "failed" in statuses else "pending" if "pending" in statuses else "done"
+        return {"job": job, "status": status, "trainings": trainings}
+
+    def get_status(self) -> Dict:
+        """
+        :return: The settings of the server and the number of trainings in progress
+        """
+        with self.lock:
+            pending = sum(training["status"] == "pending" for training in self.trainings.values())
+        return {"engine": self.engine, "seed": self.seed, "workers": self.nb_workers, "pending": pending,
+                "jobs": len(self.jobs)}
+
+    def find(self, criteria: Dict[str, str]) -> List[Dict]:
+        """
+        :param criteria: Values of key fields, as strings, e.g. game="PD", mode="fear"
+        :return: The summaries of the stored trainings matching every criterion, sorted by aspiration, without their
+        arrays
+        """
+        if any(field not in FIELD_TYPES for field in criteria):
+            raise ValueError("Unknown fields: " + ", ".join(field for field in criteria if field not in FIELD_TYPES))
+        with self.index_lock:
+            # Picks up the trainings saved by other processes, e.g. runner.py
+            self.index.update(nb_workers=1)
+            return self.index.find(**{field: FIELD_TYPES[field](value) for field, value in criteria.items()})
+
+    def get_entry(self, name: str, arrays: List[str]) -> Dict:
+        """
+        :param name: The name of an entry of the store
+        :param arrays: The arrays of the summary to include, among SUMMARY_ARRAYS
+        :return: The summary of the entry
+        """
+        if any(array not in SUMMARY_ARRAYS for array in arrays):
+            raise ValueError("Unknown arrays: " + ", ".join(array for array in arrays if array not in SUMMARY_ARRAYS))
+        with self.index_lock:
+            if name not in self.index.entries:
+                self.index.update(nb_workers=1)
+            if name not in self.index.entries:
+                raise KeyError(f"No training indexed for {name}")
+            summary = dict(self.index.entries[name])
+            for array in arrays:
+                summary[array] = self.index.get_array(summary, array).tolist()
+        return summary
+
+
+class Request_Handler(BaseHTTPRequestHandler):
+    """
+    HTTP interface of the job server:
+        - POST /jobs: submits a sweep, given as a JSON specification (see parse_trainings) or as the text of a source
+          file, the games being then given by the query string, e.g. /jobs?games=PD,SG
+        - GET /jobs/[job]: status of a job
+        - GET /entries?[field]=[value]&...: summaries of the stored trainings matching the key fields
+        - GET /entries/[name]?arrays=mean,sample: summary of a training, with the arrays asked for
+        - GET /status: settings and load of the server
+    """
+    # Set on the class by serve
+    jobs: Job_Server = None
+
+    def do_POST(self) -> None:
+        url = urlsplit(self.path)
+        if url.path != "/jobs":
+            return self.send_json(404, {"error": f"Unknown path {url.path}"})
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+        try:
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                request = json.loads(body)
+            else:
+                request = {"source": body}
+                query = parse_qs(url.query)
+                if "games" in query:
+                    request["games"] = query["games"][0].split(",")
+            self.send_json(202, self.jobs.submit(request))
+        except (ValueError, KeyError, TypeError) as error:
+            self.send_json(400, {"error": "Invalid job: {0}".format(error)})
+
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+        query = {field: values[0] for field, values in parse_qs(url.query).items()}
+        try:
+            if parts == ["status"]:
+                self.send_json(200, self.jobs.get_status())
+            elif parts[0] == "jobs" and len(parts) == 2:
+                self.send_json(200, self.jobs.get_job(parts[1]))
+            elif parts == ["entries"]:
+                self.send_json(200, self.jobs.find(query))
+            elif parts[0] == "entries" and len(parts) == 2:
+                arrays = query["arrays"].split(",") if query.get("arrays") else []
+                self.send_json(200, self.jobs.get_entry(parts[1], arrays))
+            else:
+                self.send_json(404, {"error": f"Unknown path {url.path}"})
+        except KeyError as error:
+            self.send_json(404, {"error": error.args[0]})
+        except ValueError as error:
+            self.send_json(400, {"error": str(error)})
+
+    def send_json(self, status: int, body) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve(port: int = SERVER_PORT, nb_workers: Optional[int] = None, engine: str = "batch",
+          seed: Optional[int] = None, root: str = "data/", cache_size: Optional[int] = None) -> None:
+    """
+    Runs the job server on localhost until interrupted
+    :param port: The port to listen on. Default: SERVER_PORT
+    :param nb_workers: [optional] Number of worker processes. Default: the number of CPUs
+    :param engine: The engine used by train: "classic" or "batch". Default: "batch"
+    :param seed: [optional] The root seed of every training. Default: None, drawn when the server starts
+    :param root: The folder of the result store. Default: "data/"
+    :param cache_size: [optional] Size limit of the cache in bytes. Default: None, no limit
+    """
+    # The workers are started before the socket is opened, so that they do not inherit it
+    jobs = Job_Server(nb_workers, engine, seed, root, cache_size)
+    Request_Handler.jobs = jobs
+    server = ThreadingHTTPServer(("127.0.0.1", port), Request_Handler)
+    print("Serving on http://127.0.0.1:{0} with {1} workers, seed={2}".format(port, jobs.nb_workers, jobs.seed),
+          flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        jobs.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves the training of sweeps and their summaries over HTTP")
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--engine", choices=["classic", "batch"], default="batch")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--root", default="data/")
+    parser.add_argument("--cache-size", type=int, default=None)
+    args = parser.parse_args()
+    serve(args.port, args.workers, args.engine, args.seed, args.root,
+          None if args.cache_size is None else args.cache_size * 1024 * 1024)
+
+
+if __name__ == '__main__':
+    main()
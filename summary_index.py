@@ -0,0 +1,170 @@
+import json
+import os
+from multiprocessing import Pool
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy
+from numpy import ndarray
+
+from result_store import KEY_FIELDS, Result_Store, entry_name
+from runner import compute_propo_coop_mut
+
+# Episodes whose probabilities of cooperation of agent 0 are kept for every repetition
+SNAPSHOT_EPISODES = (0, 99, 249, 499)
+# Repetition whose trajectory is kept as a sample, the one shown by the cooperation plot
+SAMPLE_REPETITION = 10
+# Number of episodes read at once when averaging over the repetitions
+SCAN_CHUNK_SIZE = 256
+# Arrays kept for every entry of the index
+SUMMARY_ARRAYS = ("mean", "sample", "snapshots")
+
+
+def summarize(root: str, name: str, entry: Dict, snapshot_episodes: Sequence[int] = SNAPSHOT_EPISODES) -> Dict:
+    """
+    Summarizes a training of the store in a single pass over its probabilities of cooperation
+    :param root: The folder of the store
+    :param name: The name of the entry
+    :param entry: The manifest entry
+    :param snapshot_episodes: The episodes of the snapshots, the ones beyond the training being dropped. Default:
+    SNAPSHOT_EPISODES
+    :return: The summary of the entry: its key, its SRE rate with the bounds of its 95% confidence interval (None
+    for trainings shorter than the episode of runner.compute_propo_coop_mut), and the
+    arrays "mean" (mean probability of cooperation of each agent, of shape (agents, episodes)), "sample" (the
+    trajectory of agent 0 in SAMPLE_REPETITION, or in the last repetition if there are fewer) and "snapshots" (the
+    probability of cooperation of agent 0 in every repetition at each snapshot episode, of shape (episodes,
+    repetitions))
+    """
+    path = os.path.join(root, entry["files"]["act_probs"])
+    # Stored in (episodes, agents, repetitions) order, so averaging over the repetitions reads the file sequentially
+    data = numpy.load(path, mmap_mode="r")
+    nb_episodes, _, nb_repetitions = data.shape
+    mean = numpy.concatenate([data[start:start + SCAN_CHUNK_SIZE].mean(axis=2)
+                              for start in range(0, nb_episodes, SCAN_CHUNK_SIZE)]).T
+    episodes = [episode for episode in snapshot_episodes if episode < nb_episodes]
+    sre, low, high = compute_propo_coop_mut(data[:, 0].T, confidence=0.95) if nb_episodes >= 100 else (None,) * 3
+    summary = {field: entry[field] for field in KEY_FIELDS}
+    summary.update({"name": name, "version": os.stat(path).st_mtime_ns, "sre": sre, "sre_low": low, "sre_high": high,
+                    "snapshot_episodes": episodes})
+    summary["mean"] = mean
+    summary["sample"] = numpy.array(data[:, 0, min(SAMPLE_REPETITION, nb_repetitions - 1)])
+    summary["snapshots"] = numpy.array(data[episodes, 0], dtype=numpy.float32)
+    return summary
+
+
+def summarize_task(task: Tuple[str, str, Dict]) -> Dict:
+    return summarize(*task)
+
+
+class Summary_Index:
+    def __init__(self, root: str = "data/"):
+        """
+        Compact summary of every training of the result store, saved as [root]/summary_index.npz: the scalar
+        statistics of the entries as JSON and a few arrays per entry, a few kilobytes per training, so that the index
+        is loaded at once and queried in memory.
+
+        :param root: The folder of the store
+        """
+        self.root = root
+        self.path = os.path.join(root, "summary_index.npz")
+        self.entries: Dict[str, Dict] = dict()
+        self.arrays: Dict[str, ndarray] = dict()
+        self.load()
+
+    def load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        with numpy.load(self.path) as index:
+            self.entries = json.loads(str(index["entries"]))
+            self.arrays = {name: index[name] for name in index.files if name != "entries"}
+
+    def save(self) -> None:
+        temporary = self.path + ".tmp.npz"
+        numpy.savez(temporary, entries=json.dumps(self.entries), **self.arrays)
+        os.replace(temporary, self.path)
+
+    def update(self, nb_workers: Optional[int] = None) -> int:
+        """
+        Scans the trainings of the store added or rewritten since the last update, in parallel, and removes the ones
+        that are no longer stored
+        :param nb_workers: [optional] Number of worker processes. Default: the number of CPUs
+        :return: The number of trainings scanned
+        """
+        manifest = Result_Store(self.root).load_manifest()
+        tasks = []
+        for name, entry in manifest.items():
+            path = os.path.join(self.root, entry["files"]["act_probs"])
+            if name not in self.entries or self.entries[name]["version"] != os.stat(path).st_mtime_ns:
+                tasks.append((self.root, name, entry))
+        removed = [name for name in self.entries if name not in manifest]
+        if not tasks and not removed:
+            return 0
+        for name in removed:
+            del self.entries[name]
+            for array in SUMMARY_ARRAYS:
+                self.arrays.pop(f"{name}.{array}", None)
+        if len(tasks) > 1 and nb_workers != 1:
+            with Pool(nb_workers) as pool:
+                summaries = pool.map(summarize_task, tasks, chunksize=1)
+        else:
+            summaries = [summarize_task(task) for task in tasks]
+        for summary in summaries:
+            self.add(summary)
+        self.save()
+        return len(tasks)
+
+    def add(self, summary: Dict) -> None:
+        """
+        Adds or replaces the summary of an entry, without saving the index
+        :param summary: A summary returned by summarize, whose arrays are moved to the index
+        """
+        for array in SUMMARY_ARRAYS:
+            self.arrays[f"{summary['name']}.{array}"] = summary.pop(array)
+        self.entries[summary["name"]] = summary
+
+    def find(self, **criteria) -> List[Dict]:
+        """
+        :param criteria: Values of key fields, e.g. game="PD", mode="fear"
+        :return: The summaries of the trainings matching every criterion, sorted by aspiration
+        """
+        matches = [entry for entry in self.entries.values()
+                   if all(entry[field] == value for field, value in criteria.items())]
+        return sorted(matches, key=lambda entry: entry["aspiration"])
+
+    def get(self, key: Dict) -> Dict:
+        """
+        :param key: The key of a training, as returned by result_store.make_key
+        :return: The summary of the training
+        """
+        if entry_name(key) not in self.entries:
+            raise KeyError(f"No training indexed for {entry_name(key)}")
+        return self.entries[entry_name(key)]
+
+    def get_array(self, entry: Dict, array: str) -> ndarray:
+        """
+        :param entry: A summary returned by find
+        :param array: "mean", "sample" or "snapshots"
+        :return: The array of the summary
+        """
+        return self.arrays[f"{entry['name']}.{array}"]
+
+    def get_sre_curve(self, game: str, mode: str, habituation: float, learning_rate: float, nb_repetitions: int,
+                      nb_episodes: int) -> Tuple[List[float], List[float]]:
+        """
+        :return: The aspirations stored for the other parameters, sorted, and the SRE rate of each
+        """
+        entries = self.find(game=game, mode=mode, habituation=float(habituation), learning_rate=float(learning_rate),
+                            nb_repetitions=int(nb_repetitions), nb_episodes=int(nb_episodes))
+        return [entry["aspiration"] for entry in entries], [entry["sre"] for entry in entries]
+
+
+def load_index(root: str = "data/", nb_workers: Optional[int] = None) -> Summary_Index:
+    """
+    :param root: The folder of the store. Default: "data/"
+    :param nb_workers: [optional] Number of worker processes scanning the new trainings. Default: the number of CPUs
+    :return: The summary index, brought up to date with the store
+    """
+    index = Summary_Index(root)
+    scanned = index.update(nb_workers)
+    if scanned:
+        print("Summary index: scanned {0} trainings, {1} indexed".format(scanned, len(index.entries)))
+    return index
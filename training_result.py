@@ -0,0 +1,65 @@
+from typing import Tuple
+
+import numpy
+from numpy import ndarray
+
+ACTION_DTYPE = numpy.uint8
+
+
+class Training_Result:
+    def __init__(self, action_probabilities: ndarray, aspirations: ndarray, stimuli: ndarray, actions: ndarray):
+        """
+        Trajectories of a training, each array being of shape (..., repetitions, agents, episodes)
+
+        :param action_probabilities: The probabilities of cooperation after each episode
+        :param aspirations: The aspirations after each episode
+        :param stimuli: The stimuli received at each episode
+        :param actions: The actions taken at each episode, 0 being cooperation and 1 defection
+        """
+        self.action_probabilities = action_probabilities
+        self.aspirations = aspirations
+        self.stimuli = stimuli
+        self.actions = actions
+
+    @classmethod
+    def allocate(cls, shape: Tuple[int, ...]) -> "Training_Result":
+        """
+        :param shape: The shape of the trajectories, (..., repetitions, agents, episodes)
+        :return: A result whose arrays are allocated but not initialized
+        """
+        return cls(numpy.empty(shape, dtype=numpy.float64), numpy.empty(shape, dtype=numpy.float64),
+                   numpy.empty(shape, dtype=numpy.float64), numpy.empty(shape, dtype=ACTION_DTYPE))
+
+    def __getitem__(self, index) -> "Training_Result":
+        """
+        :param index: Index applied to every array, e.g. a parameter set or a range of repetitions
+        :return: A result made of views on the indexed arrays
+        """
+        return Training_Result(self.action_probabilities[index], self.aspirations[index], self.stimuli[index],
+                               self.actions[index])
+
+    def as_tuple(self) -> Tuple[ndarray, ndarray, ndarray, ndarray]:
+        """
+        :return: The probabilities of cooperation, the aspirations, the stimuli and the actions
+        """
+        return self.action_probabilities, self.aspirations, self.stimuli, self.actions
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self.action_probabilities.shape
+
+    @property
+    def nb_repetitions(self) -> int:
+        return self.shape[-3]
+
+    @property
+    def nb_agents(self) -> int:
+        return self.shape[-2]
+
+    @property
+    def nb_episodes(self) -> int:
+        return self.shape[-1]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(data.nbytes for data in self.as_tuple())